@@ -1,6 +1,23 @@
-from typing import NamedTuple
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from types import MappingProxyType
+from typing import Any, NamedTuple
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from json_stream import JsonReader
 
 
 class Coordinates(NamedTuple):
@@ -20,16 +37,338 @@ PLACES = {
     "Tromsø": Coordinates(lat=69.64, lon=18.95),
 }
 
+BASE_URL = "https://api.met.no/weatherapi/locationforecast/2.0/compact"
+TIMEOUT_SECONDS = 10
+# Concurrent requests, and pooled connections, per client
+WORKERS = 8
+# Forecasts are cached for coordinates rounded to this many decimals,
+# about 1 km; api.met.no asks for at most 4
+COORDINATE_DECIMALS = 2
+CACHE_SIZE = 1_000
+# Time to live of a forecast whose response has no Expires header
+DEFAULT_TTL_SECONDS = 600.0
+READ_CHUNK_BYTES = 16 * 1024
+
+TIMESERIES_START = re.compile(r'"timeseries"\s*:\s*\[')
+# the end of a timeseries entry, when it is not the end of the buffer
+SEPARATOR = re.compile(r"\s*([,\]])\s*(?=\S)")
+# Kept of a chunk without the start of timeseries, in case it is split
+TIMESERIES_START_OVERLAP = 64
+
+
+class CacheEntry(NamedTuple):
+    expires: float
+    last_modified: str | None
+    # kind -> what was read from the forecast, see ForecastClient._get
+    values: dict[str, Any]
+
+
+class TemperatureSeries(NamedTuple):
+    times: array  # seconds since the epoch
+    temperatures: array
+
+
+class ForecastStats(NamedTuple):
+    requests: int
+    cache_hits: int
+    not_modified: int
+    cached: int
+
+
+def parse_expires(value: str | None, default: float) -> float:
+    """The Expires header as seconds since the epoch, or now plus
+    default."""
+    if value:
+        try:
+            expires = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            pass
+        else:
+            if expires.tzinfo is None:  # a -0000 zone, which is UTC
+                expires = expires.replace(tzinfo=timezone.utc)
+            return expires.timestamp()
+    return time.time() + default
+
+
+def _frozen(value: Any) -> Any:
+    if isinstance(value, list):
+        return tuple(map(_frozen, value))
+    return value
+
+
+def _frozen_object(pairs: list[tuple[str, Any]]) -> Mapping[str, Any]:
+    return MappingProxyType({key: _frozen(value) for key, value in pairs})
+
+
+def read_frozen(text: str | bytes) -> Mapping[str, Any]:
+    """Parses a JSON object into read-only mappings and tuples, which can
+    be shared without copying."""
+    return json.loads(text, object_pairs_hook=_frozen_object)
+
+
+def iter_timeseries(chunks: Iterable[bytes]) -> Iterator[dict[str, Any]]:
+    """Yields the entries of properties.timeseries of a locationforecast
+    response one at a time, parsing the body as its chunks arrive.
+
+    Only the unparsed rest of a chunk is kept, and no more chunks are read
+    than needed for the entries consumed. Raises ValueError when there is
+    no timeseries or it is not valid JSON.
+    """
+    reader = JsonReader(chunks)
+    if reader.search(TIMESERIES_START, TIMESERIES_START_OVERLAP) is None:
+        raise ValueError("no timeseries in the forecast")
+    char = reader.next_char()
+    if char == "]":
+        return
+    while char is not None:
+        yield reader.value()
+        if match := reader.match(SEPARATOR):
+            char = match.group(1)
+        else:
+            char = reader.next_char()
+            reader.pos += 1
+            if char == ",":
+                reader.next_char()
+        if char == "]":
+            return
+        if char is not None and char != ",":
+            raise ValueError("expected , or ] in timeseries")
+    raise ValueError("timeseries is not closed")
+
+
+def first_air_temperature(chunks: Iterable[bytes]) -> float:
+    """The air temperature of the first timeseries entry, parsed without
+    reading further."""
+    for entry in iter_timeseries(chunks):
+        return entry["data"]["instant"]["details"]["air_temperature"]
+    raise ValueError("the timeseries is empty")
+
+
+def temperature_series_of(
+    entries: Iterable[Mapping[str, Any]],
+) -> TemperatureSeries:
+    """The air temperatures of timeseries entries as array columns."""
+    times = array("d")
+    temperatures = array("d")
+    for entry in entries:
+        time_ = datetime.fromisoformat(entry["time"].replace("Z", "+00:00"))
+        times.append(time_.timestamp())
+        temperatures.append(
+            entry["data"]["instant"]["details"]["air_temperature"]
+        )
+    return TemperatureSeries(times, temperatures)
+
+
+def read_temperature_series(chunks: Iterable[bytes]) -> TemperatureSeries:
+    """All air temperatures of a forecast as array columns, parsing one
+    timeseries entry at a time instead of the whole document."""
+    return temperature_series_of(iter_timeseries(chunks))
+
+
+def first_temperature(series: TemperatureSeries) -> float:
+    if not series.temperatures:
+        raise ValueError("the timeseries is empty")
+    return series.temperatures[0]
+
+
+class ForecastClient:
+    """Fetches locationforecast responses over a pooled session.
+
+    Forecasts are cached by rounded coordinates until their Expires time,
+    with least recently used ones evicted beyond cache_size. An expired
+    forecast is revalidated with If-Modified-Since, so an unchanged one
+    costs a 304 without a body, as the api.met.no terms require.
+
+    The cache keeps what was read from a forecast, not its body: the
+    temperature series, from which air_temperature() takes the first
+    temperature, and the whole document once forecast() asked for it.
+    With streaming, the series is parsed one timeseries entry at a time as
+    the response arrives, instead of from the whole document.
+    """
+
+    def __init__(
+        self,
+        base_url: str = BASE_URL,
+        workers: int = WORKERS,
+        cache_size: int = CACHE_SIZE,
+        decimals: int = COORDINATE_DECIMALS,
+        default_ttl: float = DEFAULT_TTL_SECONDS,
+        timeout: float = TIMEOUT_SECONDS,
+        streaming: bool = True,
+    ) -> None:
+        self.base_url = base_url
+        self.workers = workers
+        self.cache_size = cache_size
+        self.decimals = decimals
+        self.default_ttl = default_ttl
+        self.timeout = timeout
+        self.streaming = streaming
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.cache: OrderedDict[Coordinates, CacheEntry] = OrderedDict()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.cache_hits = 0
+        self.not_modified = 0
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self) -> ForecastClient:
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def key(self, lat: float, lon: float) -> Coordinates:
+        return Coordinates(
+            round(lat, self.decimals), round(lon, self.decimals)
+        )
+
+    def _cached(self, key: Coordinates) -> CacheEntry | None:
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None:
+                self.cache.move_to_end(key)
+            return entry
+
+    def _store(self, key: Coordinates, entry: CacheEntry) -> None:
+        with self.lock:
+            self.cache[key] = entry
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def _read(self, kind: str, response: requests.Response) -> dict:
+        """The values of a response, kind among them."""
+        if kind == "forecast":
+            forecast = read_frozen(response.content)
+            series = temperature_series_of(
+                forecast["properties"]["timeseries"]
+            )
+            values = {"forecast": forecast}
+        elif self.streaming:
+            series = read_temperature_series(
+                response.iter_content(READ_CHUNK_BYTES)
+            )
+            # the rest of the body, so that the connection can be reused
+            for _ in response.iter_content(READ_CHUNK_BYTES):
+                pass
+            values = {}
+        else:
+            series = temperature_series_of(
+                response.json()["properties"]["timeseries"]
+            )
+            values = {}
+        values["temperature_series"] = series
+        values["air_temperature"] = first_temperature(series)
+        return values
+
+    def _get(self, kind: str, lat: float, lon: float) -> Any:
+        """The kind of value read from the forecast for the coordinates,
+        cached until the forecast expires."""
+        key = self.key(lat, lon)
+        entry = self._cached(key)
+        cached = entry is not None and kind in entry.values
+        if cached and entry.expires > time.time():
+            with self.lock:
+                self.cache_hits += 1
+            return entry.values[kind]
+        headers = {}
+        if cached and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        with self.session.get(
+            self.base_url,
+            params={"lat": key.lat, "lon": key.lon},
+            headers=headers,
+            timeout=self.timeout,
+            stream=True,
+        ) as response:
+            with self.lock:
+                self.requests += 1
+            expires = parse_expires(
+                response.headers.get("Expires"), self.default_ttl
+            )
+            if cached and response.status_code == 304:
+                with self.lock:
+                    self.not_modified += 1
+                self._store(key, entry._replace(expires=expires))
+                return entry.values[kind]
+            response.raise_for_status()
+            values = self._read(kind, response)
+        last_modified = response.headers.get("Last-Modified")
+        if (
+            entry is not None
+            and last_modified is not None
+            and entry.last_modified == last_modified
+        ):
+            # the same forecast, so the other values still hold
+            values = entry.values | values
+        self._store(key, CacheEntry(expires, last_modified, values))
+        return values[kind]
+
+    def forecast(self, lat: float, lon: float) -> Mapping[str, Any]:
+        """The whole forecast for the coordinates. It is shared with the
+        cache, so it is read-only: objects are mappings and arrays
+        tuples."""
+        return self._get("forecast", lat, lon)
+
+    def air_temperature(self, lat: float, lon: float) -> float:
+        return self._get("air_temperature", lat, lon)
+
+    def temperature_series(self, lat: float, lon: float) -> TemperatureSeries:
+        """The forecast air temperatures for the coordinates, by time."""
+        series = self._get("temperature_series", lat, lon)
+        # copies, the cached arrays are shared
+        return TemperatureSeries(
+            array("d", series.times), array("d", series.temperatures)
+        )
+
+    def air_temperatures(
+        self, coordinates: Iterable[Coordinates]
+    ) -> dict[Coordinates, float]:
+        """Current air temperatures of many coordinates, fetched
+        concurrently. Coordinates that share a cache key are fetched
+        once."""
+        coordinates = list(coordinates)
+        keys = {self.key(*place) for place in coordinates}
+        with ThreadPoolExecutor(self.workers) as pool:
+            temperatures = dict(
+                zip(
+                    keys,
+                    pool.map(lambda key: self.air_temperature(*key), keys),
+                )
+            )
+        return {place: temperatures[self.key(*place)] for place in coordinates}
+
+    def stats(self) -> ForecastStats:
+        with self.lock:
+            return ForecastStats(
+                requests=self.requests,
+                cache_hits=self.cache_hits,
+                not_modified=self.not_modified,
+                cached=len(self.cache),
+            )
+
+
+_client: ForecastClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> ForecastClient:
+    """The client shared by the module-level functions."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ForecastClient()
+        return _client
+
 
 def get_air_temp_by_coordinates(lat: float, lon: float) -> float:
-    url = (
-        "https://api.met.no/weatherapi/locationforecast/2.0/compact?lat="
-        f"{lat}&lon={lon}"
-    )
-    response = requests.get(url, headers=HEADERS, timeout=10)
-    return response.json()["properties"]["timeseries"][0]["data"]["instant"][
-        "details"
-    ]["air_temperature"]
+    return get_client().air_temperature(lat, lon)
 
 
 def get_air_temp_by_place(place: str) -> float:
@@ -37,8 +376,15 @@ def get_air_temp_by_place(place: str) -> float:
 
 
 def main():
-    for key in PLACES:
-        print(get_air_temp_by_place(key))
+    parser = argparse.ArgumentParser(
+        description="Current air temperature of some places"
+    )
+    parser.add_argument("--base-url", default=BASE_URL)
+    args = parser.parse_args()
+    with ForecastClient(args.base_url) as client:
+        temperatures = client.air_temperatures(PLACES.values())
+    for place, coordinates in PLACES.items():
+        print(place, temperatures[coordinates])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from airtemp import HEADERS, Coordinates, ForecastClient
+
+
+# Entries in a synthetic compact forecast, about as many as api.met.no sends
+TIMESERIES_ENTRIES = 90
+LAST_MODIFIED = formatdate(0, usegmt=True)
+
+
+def make_forecast(lat: float, lon: float, entries: int) -> dict:
+    """A synthetic locationforecast/2.0/compact response."""
+    rng = random.Random(f"{lat},{lon}")
+    start = int(time.time()) // 3600 * 3600
+    details = (
+        "air_pressure_at_sea_level",
+        "air_temperature",
+        "cloud_area_fraction",
+        "relative_humidity",
+        "wind_from_direction",
+        "wind_speed",
+    )
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [lon, lat, 10]},
+        "properties": {
+            "meta": {"updated_at": formatdate(start, usegmt=True)},
+            "timeseries": [
+                {
+                    "time": time.strftime(
+                        "%Y-%m-%dT%H:%M:%SZ", time.gmtime(start + 3600 * i)
+                    ),
+                    "data": {
+                        "instant": {
+                            "details": {
+                                name: round(rng.uniform(-20, 30), 1)
+                                for name in details
+                            }
+                        },
+                        "next_1_hours": {
+                            "summary": {"symbol_code": "cloudy"},
+                            "details": {"precipitation_amount": 0.0},
+                        },
+                    },
+                }
+                for i in range(entries)
+            ],
+        },
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves synthetic forecasts with the caching headers of api.met.no,
+    after the configured latency."""
+
+    protocol_version = "HTTP/1.1"
+    server: StubServer
+
+    def do_GET(self) -> None:
+        time.sleep(self.server.latency)
+        query = parse_qs(urlsplit(self.path).query)
+        with self.server.lock:
+            self.server.requests += 1
+        headers = {
+            "Expires": formatdate(time.time() + self.server.ttl, usegmt=True),
+            "Last-Modified": LAST_MODIFIED,
+        }
+        if self.headers.get("If-Modified-Since") == LAST_MODIFIED:
+            self.send_response(304)
+            body = b""
+        else:
+            self.send_response(200)
+            forecast = make_forecast(
+                float(query["lat"][0]),
+                float(query["lon"][0]),
+                self.server.entries,
+            )
+            body = json.dumps(forecast).encode()
+            headers["Content-Type"] = "application/json"
+            with self.server.lock:
+                self.server.body_bytes += len(body)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, latency: float, ttl: float, entries: int) -> None:
+        super().__init__(("localhost", 0), StubHandler)
+        self.latency = latency
+        self.ttl = ttl
+        self.entries = entries
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.body_bytes = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://localhost:{self.server_address[1]}/compact"
+
+    def take_counts(self) -> tuple[int, int]:
+        with self.lock:
+            counts = self.requests, self.body_bytes
+            self.requests = self.body_bytes = 0
+        return counts
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="ForecastClient against a local stub of api.met.no"
+    )
+    parser.add_argument("--places", type=int, default=200)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="seconds per request"
+    )
+    parser.add_argument(
+        "--ttl", type=float, default=10.0, help="seconds until Expires"
+    )
+    parser.add_argument("--entries", type=int, default=TIMESERIES_ENTRIES)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    server = StubServer(args.latency, args.ttl, args.entries)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    rng = random.Random(4175)
+    places = [
+        Coordinates(
+            round(rng.uniform(58, 71), 2), round(rng.uniform(5, 30), 2)
+        )
+        for _ in range(args.places)
+    ]
+
+    def report(name: str, elapsed: float) -> None:
+        requests_made, body_bytes = server.take_counts()
+        print(
+            f"{name + ':':24}{elapsed:8.2f} s {requests_made:6} requests "
+            f"{body_bytes / 1e6:8.2f} MB"
+        )
+
+    start = time.perf_counter()
+    for lat, lon in places:
+        requests.get(
+            server.url, {"lat": lat, "lon": lon}, headers=HEADERS, timeout=10
+        ).json()["properties"]["timeseries"][0]
+    report("requests.get, in turn", time.perf_counter() - start)
+
+    with ForecastClient(server.url) as client:
+        start = time.perf_counter()
+        client.air_temperatures(places)
+        report("client, cold cache", time.perf_counter() - start)
+
+        start = time.perf_counter()
+        client.air_temperatures(places)
+        report("client, fresh cache", time.perf_counter() - start)
+
+        time.sleep(args.ttl)
+        start = time.perf_counter()
+        client.air_temperatures(places)
+        report("client, expired cache", time.perf_counter() - start)
+        print(client.stats())
+    server.shutdown()
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import time
+import tracemalloc
+from array import array
+from collections.abc import Callable, Iterator
+from datetime import datetime
+from typing import Any
+
+from airtemp import (
+    PLACES,
+    READ_CHUNK_BYTES,
+    TemperatureSeries,
+    first_air_temperature,
+    read_temperature_series,
+)
+from benchmark_airtemp import TIMESERIES_ENTRIES, make_forecast
+
+
+REPEATS = 50
+
+
+def iter_chunks(payload: bytes) -> Iterator[bytes]:
+    """The payload in chunks, as Response.iter_content yields it."""
+    for start in range(0, len(payload), READ_CHUNK_BYTES):
+        yield payload[start : start + READ_CHUNK_BYTES]
+
+
+def json_first_temperature(payload: bytes) -> float:
+    # what response.json() does: join the whole body, then parse it
+    forecast = json.loads(b"".join(iter_chunks(payload)))
+    return forecast["properties"]["timeseries"][0]["data"]["instant"][
+        "details"
+    ]["air_temperature"]
+
+
+def json_temperature_series(payload: bytes) -> TemperatureSeries:
+    forecast = json.loads(b"".join(iter_chunks(payload)))
+    times = array("d")
+    temperatures = array("d")
+    for entry in forecast["properties"]["timeseries"]:
+        time_ = datetime.fromisoformat(entry["time"].replace("Z", "+00:00"))
+        times.append(time_.timestamp())
+        temperatures.append(
+            entry["data"]["instant"]["details"]["air_temperature"]
+        )
+    return TemperatureSeries(times, temperatures)
+
+
+METHODS: dict[str, Callable[[bytes], Any]] = {
+    "first, response.json()": json_first_temperature,
+    "first, streaming": lambda payload: first_air_temperature(
+        iter_chunks(payload)
+    ),
+    "series, response.json()": json_temperature_series,
+    "series, streaming": lambda payload: read_temperature_series(
+        iter_chunks(payload)
+    ),
+}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Parse time and peak memory of forecast extraction"
+    )
+    parser.add_argument(
+        "fixtures",
+        nargs="*",
+        help="recorded locationforecast responses, by default synthetic "
+        "ones for PLACES",
+    )
+    parser.add_argument(
+        "--entries",
+        type=int,
+        default=TIMESERIES_ENTRIES,
+        help="timeseries entries of the synthetic responses",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.fixtures:
+        payloads = []
+        for path in args.fixtures:
+            with open(path, "rb") as file:
+                payloads.append(file.read())
+    else:
+        payloads = [
+            json.dumps(make_forecast(lat, lon, args.entries)).encode()
+            for lat, lon in PLACES.values()
+        ]
+    size = statistics.mean(map(len, payloads))
+    print(f"{len(payloads)} responses, {size / 1e3:.0f} kB on average")
+
+    for name, method in METHODS.items():
+        times = []
+        for _ in range(REPEATS):
+            for payload in payloads:
+                start = time.perf_counter()
+                method(payload)
+                times.append(time.perf_counter() - start)
+        peaks = []
+        for payload in payloads:
+            tracemalloc.start()
+            method(payload)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        print(
+            f"{name + ':':26}{statistics.median(times) * 1000:8.3f} ms "
+            f"{max(peaks) / 1e3:10.0f} kB peak"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import argparse
+import importlib
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any
+
+import dearpygui.dearpygui as dpg
+import paho.mqtt.client as mqtt
+
+from chat_session import CONTACTS
+from event_queue import EVENT_MESSAGE
+from mqtt_broker import MqttBroker
+from wire_codec import decode_payload, encode_payload
+
+
+FRAME_SECONDS = 1 / 60
+DRAIN_SECONDS = 2.0
+
+
+class LoadGenerator(threading.Thread):
+    """Simulates the other chat clients, each with its own MQTT connection.
+
+    Every peer sends messages and typing notifications to the client under
+    test as Poisson processes with the given per-peer rates, acknowledges
+    messages it receives with a delivered receipt and reads them with the
+    given probability. The publish time of every message is recorded in
+    published, keyed by uuid.
+    """
+
+    def __init__(
+        self,
+        peers: list[str],
+        target: str,
+        host: str,
+        port: int,
+        message_rate: float,
+        typing_rate: float,
+        read_ratio: float,
+        compact: bool,
+    ) -> None:
+        super().__init__(name="load-generator", daemon=True)
+        self.target = target
+        self.message_rate = message_rate
+        self.typing_rate = typing_rate
+        self.read_ratio = read_ratio
+        self.compact = compact
+        self.rng = random.Random(4175)
+        self.published: dict[str, float] = {}
+        self.sent = 0
+        self.stopped = threading.Event()
+        self.clients: dict[str, mqtt.Client] = {}
+        for peer in peers:
+            client = mqtt.Client(client_id=f"load-{peer}")
+            client.user_data_set(peer)
+            client.on_message = self._on_message
+            client.connect(host, port)
+            client.subscribe(f"ttm4175/chat/{peer}/message")
+            client.loop_start()
+            self.clients[peer] = client
+
+    def _publish(
+        self, peer: str, kind: str, payload_dict: dict[str, Any], qos: int
+    ) -> None:
+        receiver = payload_dict["receiver"]
+        self.clients[peer].publish(
+            f"ttm4175/chat/{receiver}/{kind}",
+            encode_payload(payload_dict, self.compact),
+            qos,
+        )
+
+    def _on_message(
+        self, client: mqtt.Client, peer: str, msg: mqtt.MQTTMessage
+    ) -> None:
+        # runs in the peer's network thread, so no shared rng
+        data = decode_payload(msg.payload)
+        receipt = {"sender": peer, "receiver": data["sender"]}
+        receipt["uuid"] = data["uuid"]
+        self._publish(peer, "delivered", receipt, 1)
+        if random.random() < self.read_ratio:
+            self._publish(peer, "read", receipt, 1)
+
+    def run(self) -> None:
+        peers = list(self.clients)
+        total_rate = len(peers) * (self.message_rate + self.typing_rate)
+        message_share = self.message_rate / (
+            self.message_rate + self.typing_rate
+        )
+        due = time.perf_counter()
+        while not self.stopped.is_set():
+            due += self.rng.expovariate(total_rate)
+            if (delay := due - time.perf_counter()) > 0:
+                time.sleep(delay)
+            peer = self.rng.choice(peers)
+            payload_dict = {"sender": peer, "receiver": self.target}
+            if self.rng.random() < message_share:
+                message_uuid = uuid.uuid4().hex
+                payload_dict["message"] = f"Load message {self.sent}"
+                payload_dict["uuid"] = message_uuid
+                self.published[message_uuid] = time.perf_counter()
+                self._publish(peer, "message", payload_dict, 1)
+                self.sent += 1
+            else:
+                self._publish(peer, "typing", payload_dict, 0)
+
+    def stop(self) -> None:
+        """Stops sending; the peers keep answering until close()."""
+        self.stopped.set()
+        self.join()
+
+    def close(self) -> None:
+        for client in self.clients.values():
+            client.disconnect()
+            client.loop_stop()
+
+
+def percentiles(latencies: list[float]) -> str:
+    if not latencies:
+        return "no samples"
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    return f"p50 {p50:8.2f} ms   p99 {p99:8.2f} ms   ({len(latencies)})"
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="End-to-end load test of chat_with_mqtt and ChatGui"
+    )
+    parser.add_argument(
+        "--host", help="external broker, default: an in-process broker"
+    )
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument(
+        "--message-rate", type=float, default=5.0, help="per peer, msgs/s"
+    )
+    parser.add_argument(
+        "--typing-rate", type=float, default=2.0, help="per peer, msgs/s"
+    )
+    parser.add_argument(
+        "--send-rate", type=float, default=20.0, help="own messages/s"
+    )
+    parser.add_argument(
+        "--read-ratio",
+        type=float,
+        default=0.5,
+        help="share of own messages the peers mark as read",
+    )
+    parser.add_argument("--compact", action="store_true")
+    parser.add_argument(
+        "--watch", default="team1a", help="contact shown in the GUI"
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    broker = None
+    if args.host is None:
+        broker = MqttBroker().start()
+        args.host, args.port = broker.host, broker.port
+    # chat_with_mqtt opens its history database in the working directory
+    os.chdir(tempfile.mkdtemp(prefix="chat-load-"))
+    chat = importlib.import_module("chat_with_mqtt")
+    chat.COMPACT_WIRE = args.compact
+    chat.connect(args.host, args.port)
+    gui = chat.GUI
+
+    added: list[float] = []
+    rendered: list[float] = []
+    pending_render: dict[bytes | str, float] = {}
+    generator = LoadGenerator(
+        [contact for contact in CONTACTS if contact != chat.MY_ID],
+        chat.MY_ID,
+        args.host,
+        args.port,
+        args.message_rate,
+        args.typing_rate,
+        args.read_ratio,
+        args.compact,
+    )
+
+    def on_session_event(kind: str, contact: str) -> None:
+        if kind != EVENT_MESSAGE:
+            return
+        message = gui.data.history_by_contact[contact].messages[-1]
+        if (start := generator.published.pop(message.uuid, None)) is None:
+            return
+        added.append(time.perf_counter() - start)
+        if contact == args.watch:
+            pending_render[message.key] = start
+
+    gui.session.add_listener(on_session_event)
+
+    dpg.create_context()
+    gui._show_gui()
+    gui.select(args.watch)
+
+    generator.start()
+    start = time.perf_counter()
+    end = start + args.duration
+    next_send = start
+    frame_times: list[float] = []
+    while (now := time.perf_counter()) < end + DRAIN_SECONDS:
+        if args.send_rate and now < end and now >= next_send:
+            next_send += 1 / args.send_rate
+            gui.send(random.choice(gui.data.contacts), "Hei fra team5b")
+        if now >= end and not generator.stopped.is_set():
+            generator.stop()
+        gui.main_callback()
+        # rendered means the message's widget exists; without a viewport
+        # no frame is drawn, so GPU time is not included
+        for key in [k for k in pending_render if k in gui.message_view.items]:
+            rendered.append(time.perf_counter() - pending_render.pop(key))
+        frame_times.append(time.perf_counter() - now)
+        if (delay := FRAME_SECONDS - frame_times[-1]) > 0:
+            time.sleep(delay)
+    generator.close()
+    chat.CONNECTION.stop()
+    gui.session.close()
+    dpg.destroy_context()
+    if broker is not None:
+        broker.stop()
+
+    print(
+        f"{len(generator.clients)} peers for {args.duration:.0f} s: "
+        f"{generator.sent} messages sent, {len(added)} added, "
+        f"{len(generator.published)} lost or late"
+    )
+    rendered_label = f"publish -> rendered ({args.watch}):"
+    print(f"{'publish -> History.add_message:':34}{percentiles(added)}")
+    print(f"{rendered_label:34}{percentiles(rendered)}")
+    print(f"{'frame time:':34}{percentiles(frame_times)}")
+    print(
+        f"{len(pending_render)} watched messages scrolled past before "
+        "they were rendered"
+    )
+    print(
+        f"router: {chat.ROUTER.routed} routed, {chat.ROUTER.dropped} dropped"
+    )
+    print(f"event queue: {gui.events.stats()}")
+    print(f"connection: {chat.CONNECTION.stats()}")
+    print(
+        f"outbox: {len(chat.OUTBOX)} unconfirmed, "
+        f"{chat.OUTBOX.retransmitted} retransmitted"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import json
+import sys
+import tracemalloc
+import uuid
+from collections.abc import Callable
+from typing import Any
+
+from chat_gui import History, Message
+
+MESSAGE_COUNT = 100_000
+
+
+class LegacyMessage:
+    """Message as it was before __slots__, packed uuids and status enums."""
+
+    def __init__(
+        self,
+        sender: str,
+        receiver: str,
+        message: str,
+        message_uuid: str,
+        sent_by_me: bool,
+    ) -> None:
+        self.sender = sender
+        self.message = message
+        self.receiver = receiver
+        self.uuid = message_uuid
+        self.send_status = None
+        self.receive_status = None
+        self.sent_by_me = sent_by_me
+
+
+class LegacyHistory:
+    def __init__(self, contact: str) -> None:
+        self.contact = contact
+        self.messages: list[LegacyMessage] = []
+        self.messages_by_uuid: dict[str, LegacyMessage] = {}
+
+    def add_message(self, message: LegacyMessage) -> None:
+        self.messages.append(message)
+        self.messages_by_uuid[message.uuid] = message
+
+
+def make_payloads(count: int) -> list[bytes]:
+    return [
+        json.dumps(
+            {
+                "sender": "team7a",
+                "receiver": "team5b",
+                "message": f"Message number {i}",
+                "uuid": uuid.uuid4().hex,
+            }
+        ).encode()
+        for i in range(count)
+    ]
+
+
+def measure(
+    payloads: list[bytes],
+    make_history: Callable[[], Any],
+    make_message: Callable[..., Any],
+) -> float:
+    """Bytes allocated per message for decoding and storing payloads."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    history = make_history()
+    for payload in payloads:
+        data = json.loads(payload)
+        history.add_message(
+            make_message(
+                data["sender"],
+                data["receiver"],
+                data["message"],
+                data["uuid"],
+                False,
+            )
+        )
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(payloads)
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else MESSAGE_COUNT
+    payloads = make_payloads(count)
+    legacy = measure(payloads, lambda: LegacyHistory("team7a"), LegacyMessage)
+    compact = measure(payloads, lambda: History("team7a"), Message)
+    print(f"Messages:          {count}")
+    print(f"Before (bytes/msg): {legacy:8.1f}")
+    print(f"After  (bytes/msg): {compact:8.1f}")
+    print(f"Saved:              {1 - compact / legacy:8.1%}")
+
+
+if __name__ == "__main__":
+    main()
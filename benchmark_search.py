@@ -0,0 +1,93 @@
+import itertools
+import random
+import sys
+import time
+import uuid
+
+from chat_session import CONTACTS, pack_uuid
+from search_index import SearchIndex
+
+MESSAGE_COUNT = 1_000_000
+VOCABULARY_SIZE = 20_000
+WORDS_PER_MESSAGE = (3, 15)
+QUERIES = 200
+
+
+def make_vocabulary(rng: random.Random) -> list[str]:
+    letters = "abcdefghijklmnopqrstuvwxyzæøå"
+    return [
+        "".join(rng.choices(letters, k=rng.randint(2, 10)))
+        for _ in range(VOCABULARY_SIZE)
+    ]
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else MESSAGE_COUNT
+    rng = random.Random(4175)
+    vocabulary = make_vocabulary(rng)
+    # word frequencies roughly follow Zipf's law, like in real text
+    cum_weights = list(
+        itertools.accumulate(
+            1 / rank for rank in range(1, VOCABULARY_SIZE + 1)
+        )
+    )
+
+    index = SearchIndex()
+    start = time.perf_counter()
+    for i in range(count):
+        words = rng.choices(
+            vocabulary,
+            cum_weights=cum_weights,
+            k=rng.randint(*WORDS_PER_MESSAGE),
+        )
+        index.add(
+            CONTACTS[i % len(CONTACTS)],
+            pack_uuid(uuid.UUID(int=rng.getrandbits(128)).hex),
+            " ".join(words),
+        )
+    elapsed = time.perf_counter() - start
+    memory = (
+        sys.getsizeof(index.keys)
+        + sum(map(sys.getsizeof, index.keys))
+        + sys.getsizeof(index.doc_contacts)
+        + sys.getsizeof(index.postings)
+        + sum(map(sys.getsizeof, index.postings.values()))
+        + sum(map(sys.getsizeof, index.postings))
+        + sys.getsizeof(index.tokens)
+    )
+    print(f"Messages indexed:       {count:12,}")
+    print(f"Indexed/s:              {count / elapsed:12,.0f}")
+    print(f"Index memory (MB):      {memory / 1e6:12.1f}")
+
+    queries = {
+        "common word": [vocabulary[rng.randrange(10)] for _ in range(QUERIES)],
+        "rare word": [
+            vocabulary[rng.randrange(1_000, len(vocabulary))]
+            for _ in range(QUERIES)
+        ],
+        "prefix": [
+            vocabulary[rng.randrange(1_000)][:3] for _ in range(QUERIES)
+        ],
+        "two words": [
+            " ".join([vocabulary[rng.randrange(100)], rng.choice(vocabulary)])
+            for _ in range(QUERIES)
+        ],
+        "one contact": [
+            vocabulary[rng.randrange(100)] for _ in range(QUERIES)
+        ],
+    }
+    for name, batch in queries.items():
+        contact = CONTACTS[0] if name == "one contact" else None
+        times = []
+        for query in batch:
+            start = time.perf_counter()
+            index.search(query, contact)
+            times.append(time.perf_counter() - start)
+        times.sort()
+        p50 = times[len(times) // 2] * 1000
+        p99 = times[int(len(times) * 0.99)] * 1000
+        print(f"{name + ':':24}p50 {p50:7.3f} ms   p99 {p99:7.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import sys
+import time
+import tracemalloc
+import uuid
+
+from chat_session import CONTACTS, ChatSession
+
+
+SESSION_COUNT = 1_000
+MESSAGES_PER_SESSION = 20
+
+
+def ignore(*args: object) -> None:
+    pass
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else SESSION_COUNT
+    tracemalloc.start()
+    sessions = [
+        ChatSession(CONTACTS[i % len(CONTACTS)], ignore, ignore, ignore)
+        for i in range(count)
+    ]
+    per_session = tracemalloc.get_traced_memory()[0] / count
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for session in sessions:
+        contact = session.data.contacts[0]
+        for i in range(MESSAGES_PER_SESSION):
+            session.receive(contact, f"Message number {i}", uuid.uuid4().hex)
+            session.typing(contact)
+        session.mark_as_read(contact)
+    elapsed = time.perf_counter() - start
+    events = count * MESSAGES_PER_SESSION * 2
+    print(f"Sessions:               {count:8}")
+    print(f"Memory (bytes/session): {per_session:8.0f}")
+    print(f"Events applied/s:       {events / elapsed:8,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from collections.abc import Callable
+from typing import Any
+
+from topic_router import TopicRouter
+from wire_codec import decode_payload, encode_payload, is_compact
+
+
+REPLAY_RATE = 50_000
+STREAM_LENGTH = 200_000
+CONTACTS = [f"team{i}{side}" for i in range(1, 13) for side in "ab"] + [
+    f"x{i}" for i in range(1, 7)
+]
+# share of each topic kind in the generated stream, "presence" is unknown
+KIND_WEIGHTS = {
+    "message": 40,
+    "delivered": 25,
+    "read": 15,
+    "typing": 15,
+    "presence": 5,
+}
+# the fields each kind's handler reads, as chat_with_mqtt registers them
+KIND_FIELDS = {
+    "message": ("message", "uuid"),
+    "delivered": ("uuid",),
+    "read": ("uuid",),
+    "typing": (),
+}
+# where the legacy chain prints, instead of the terminal it printed to
+LEGACY_OUTPUT = open(os.devnull, "w")
+
+
+def generate_stream(length: int) -> list[tuple[str, bytes]]:
+    rng = random.Random(4175)
+    kinds = rng.choices(
+        list(KIND_WEIGHTS), weights=list(KIND_WEIGHTS.values()), k=length
+    )
+    stream: list[tuple[str, bytes]] = []
+    for kind in kinds:
+        sender, receiver = rng.sample(CONTACTS, 2)
+        payload_dict: dict[str, Any] = {"sender": sender, "receiver": receiver}
+        if kind == "message":
+            payload_dict["message"] = "Hei, hvordan går det?"
+        if kind in ("message", "delivered", "read"):
+            payload_dict["uuid"] = uuid.UUID(int=rng.getrandbits(128)).hex
+        payload = encode_payload(payload_dict, rng.random() < 0.5)
+        stream.append((f"ttm4175/chat/{receiver}/{kind}", payload))
+    return stream
+
+
+def load_stream(path: str) -> list[tuple[str, bytes]]:
+    """Reads a recording with one {"topic": ..., "payload": ...} per line."""
+    with open(path, encoding="utf-8") as file:
+        return [
+            (record["topic"], record["payload"].encode())
+            for record in map(json.loads, file)
+        ]
+
+
+def handle(data: dict[str, Any]) -> None:
+    pass
+
+
+def make_legacy_route() -> Callable[[str, bytes], None]:
+    """The on_message before the router: it printed every message, decoded
+    every payload and picked the handler with an endswith() chain."""
+    compact_peers: set[str] = set()
+
+    def legacy_route(topic: str, payload: bytes) -> None:
+        print(f"{topic} 1 {payload}", file=LEGACY_OUTPUT)
+        try:
+            data = decode_payload(payload)
+        except ValueError as e:
+            print(e, file=LEGACY_OUTPUT)
+            return
+        if is_compact(payload):
+            compact_peers.add(data["sender"])
+        print(topic, file=LEGACY_OUTPUT)
+        if topic.endswith("message"):
+            handle(data)
+        elif topic.endswith("delivered"):
+            handle(data)
+        elif topic.endswith("read"):
+            handle(data)
+        elif topic.endswith("typing"):
+            handle(data)
+        else:
+            print(f"Unknown topic: {topic}", file=LEGACY_OUTPUT)
+
+    return legacy_route
+
+
+def make_router() -> TopicRouter:
+    router = TopicRouter()
+    for kind, fields in KIND_FIELDS.items():
+        router.register(kind, handle, fields)
+    return router
+
+
+def throughput(
+    route: Callable[[str, bytes], Any], stream: list[tuple[str, bytes]]
+) -> float:
+    start = time.perf_counter()
+    for topic, payload in stream:
+        route(topic, payload)
+    return len(stream) / (time.perf_counter() - start)
+
+
+def replay(
+    route: Callable[[str, bytes], Any],
+    stream: list[tuple[str, bytes]],
+    rate: float,
+) -> tuple[float, float]:
+    """Replays the stream paced at rate messages/s. Returns the achieved
+    rate and the p99 lag behind the schedule in milliseconds."""
+    lags: list[float] = []
+    start = time.perf_counter()
+    for index, (topic, payload) in enumerate(stream):
+        due = start + index / rate
+        while (now := time.perf_counter()) < due:
+            pass
+        route(topic, payload)
+        lags.append(now - due)
+    elapsed = time.perf_counter() - start
+    lags.sort()
+    return len(stream) / elapsed, lags[int(len(lags) * 0.99)] * 1000
+
+
+def main() -> None:
+    if len(sys.argv) > 1:
+        stream = load_stream(sys.argv[1])
+    else:
+        stream = generate_stream(STREAM_LENGTH)
+    print(f"Stream: {len(stream)} messages")
+    routes = {
+        "Legacy endswith chain": make_legacy_route,
+        "TopicRouter": lambda: make_router().route,
+    }
+    for name, make_route in routes.items():
+        print(
+            f"{name + ' unthrottled:':46}"
+            f"{throughput(make_route(), stream):>10,.0f} msgs/s"
+        )
+    for name, make_route in routes.items():
+        achieved, p99_lag = replay(make_route(), stream, REPLAY_RATE)
+        print(
+            f"{name + f' replay at {REPLAY_RATE:,} msgs/s:':46}"
+            f"{achieved:>10,.0f} msgs/s, p99 lag {p99_lag:.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import threading
+import time
+from http.server import HTTPServer
+
+from timeseries import TimeSeriesStore
+from webserver import (
+    READINGS_PATH,
+    WORKERS,
+    PooledHTTPServer,
+    RequestHandler,
+    encode_string_into_url,
+)
+
+
+def post_readings(
+    port: int,
+    sensor: int,
+    count: int,
+    batch: int,
+    keep_alive: bool,
+    latencies: list[float],
+) -> None:
+    """Posts count requests one at a time and appends the latency of each
+    to latencies. Each request has one temperature in the query string,
+    like the original sensor client, or with batch, that many readings as
+    a JSON array to READINGS_PATH."""
+    connection = http.client.HTTPConnection("localhost", port, timeout=30)
+    readings = [
+        {"temperature": 20.0 + i % 10, "sensor_name": f"s{sensor}"}
+        for i in range(max(batch, 1))
+    ]
+    body = json.dumps(readings).encode()
+    for i in range(count):
+        start = time.perf_counter()
+        if batch:
+            connection.request(
+                "POST",
+                READINGS_PATH,
+                body,
+                {"Content-Type": "application/json"},
+            )
+        else:
+            path = "/?data=" + encode_string_into_url(json.dumps(readings[0]))
+            connection.request("POST", path)
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if not keep_alive or response.will_close:
+            connection.close()
+    connection.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Concurrent POST clients against webserver on localhost"
+    )
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200, help="per client")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help="worker threads, 0 for the single-threaded HTTPServer",
+    )
+    parser.add_argument(
+        "--batch",
+        type=int,
+        default=0,
+        help="readings per request, posted as a JSON array",
+    )
+    parser.add_argument(
+        "--close",
+        action="store_true",
+        help="a new connection per request instead of keep-alive",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.workers:
+        httpd: HTTPServer = PooledHTTPServer(
+            ("localhost", 0), RequestHandler, args.workers
+        )
+        httpd.verbose = False
+    else:
+        httpd = HTTPServer(("localhost", 0), RequestHandler)
+        setattr(httpd, "verbose", False)
+        setattr(httpd, "series", TimeSeriesStore())
+    port = httpd.server_address[1]
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    per_client: list[list[float]] = [[] for _ in range(args.clients)]
+    clients = [
+        threading.Thread(
+            target=post_readings,
+            args=(
+                port,
+                sensor,
+                args.requests,
+                args.batch,
+                not args.close,
+                latencies,
+            ),
+        )
+        for sensor, latencies in enumerate(per_client)
+    ]
+    start = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - start
+    httpd.shutdown()
+    httpd.server_close()
+
+    latencies = sorted(sum(per_client, []))
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    server = f"{args.workers} workers" if args.workers else "single thread"
+    connections = "close" if args.close else "keep-alive"
+    print(f"{args.clients} clients, {server}, {connections}")
+    print(f"Requests:         {len(latencies):10,}")
+    print(f"Requests/s:       {len(latencies) / elapsed:10,.0f}")
+    if args.batch:
+        readings = len(latencies) * args.batch
+        print(f"Readings/s:       {readings / elapsed:10,.0f}")
+    print(f"Latency p50 (ms): {p50:10.2f}")
+    print(f"Latency p99 (ms): {p99:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
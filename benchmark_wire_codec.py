@@ -0,0 +1,67 @@
+import json
+import sys
+import time
+import uuid
+from collections.abc import Callable
+from typing import Any
+
+from wire_codec import decode_payload, encode_payload
+
+
+ITERATIONS = 100_000
+
+
+def sample_payloads() -> dict[str, dict[str, Any]]:
+    return {
+        "message": {
+            "sender": "team5b",
+            "receiver": "team7a",
+            "message": "Hei! Skal vi møtes på labben i morgen?",
+            "uuid": uuid.uuid4().hex,
+        },
+        "delivered": {
+            "sender": "team7a",
+            "receiver": "team5b",
+            "uuid": uuid.uuid4().hex,
+        },
+        "read (50 uuids)": {
+            "sender": "team7a",
+            "receiver": "team5b",
+            "uuid": (uuids := [uuid.uuid4().hex for _ in range(50)])[-1],
+            "uuids": uuids,
+        },
+        "typing": {"sender": "team5b", "receiver": "team7a"},
+    }
+
+
+def rate(function: Callable[[], Any], iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return iterations / (time.perf_counter() - start)
+
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else ITERATIONS
+    print(
+        f"{'payload':<16}{'format':<9}{'bytes':>7}"
+        f"{'encode/s':>12}{'decode/s':>12}"
+    )
+    for name, payload_dict in sample_payloads().items():
+        for compact in (False, True):
+            payload = encode_payload(payload_dict, compact)
+            assert decode_payload(payload) == json.loads(
+                json.dumps(payload_dict)
+            )
+            encode_rate = rate(
+                lambda: encode_payload(payload_dict, compact), iterations
+            )
+            decode_rate = rate(lambda: decode_payload(payload), iterations)
+            print(
+                f"{name:<16}{'compact' if compact else 'json':<9}"
+                f"{len(payload):>7}{encode_rate:>12,.0f}{decode_rate:>12,.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,40 @@
 from __future__ import annotations
 
+import math
 import time
-import uuid
+from bisect import bisect_right
+from collections import OrderedDict
 from collections.abc import Callable, Sequence
 from typing import Any
 
 import dearpygui.dearpygui as dpg
 
+# Message, History and Data used to live here and are still importable
+from chat_session import (
+    BROADCAST_RECEIVER,
+    EVENT_SENT,
+    MESSAGE_PAGE_SIZE,
+    RECEIVE_STATUS_READ,
+    SEND_RECEIPT_DELIVERED,
+    SEND_RECEIPT_READ,
+    ChatSession,
+    Data,
+    History,
+    Message,
+    MessageStatus,
+)
+from chat_store import MessageStore
+from event_queue import EVENT_MESSAGE, EventQueue
+from search_index import SearchIndex
 
-SEND_RECEIPT_READ = "read"
-SEND_RECEIPT_DELIVERED = "delivered"
-
-RECEIVE_STATUS_READ = "read"
 
 PRIMARY_WINDOW = "main"
 STATUS_LABEL = "status_label"
 MY_NAME_LABEL = "my_name_label"
 MESSAGE_INPUT = "message_input"
 CONTACT_LIST = "contact_list"
+SEARCH_INPUT = "search_input"
+SEARCH_RESULTS = "search_results"
 
 MESSAGE_GROUP = "MESSAGE_GROUP"
 
@@ -34,118 +51,305 @@ CONTACT_LIST_WIDTH = 150
 MESSAGE_INPUT_HEIGHT = 80
 MESSAGE_WINDOW_HEIGHT = MAIN_WINDOW_HEIGHT - MESSAGE_INPUT_HEIGHT - 60
 
+# Virtualized message view: only the visible rows plus a margin are widgets,
+# see MESSAGE_PAGE_SIZE for paging
+MESSAGE_VIEW_MARGIN = MESSAGE_WINDOW_HEIGHT // 2
+MESSAGE_LINE_HEIGHT = 13
+MESSAGE_ITEM_SPACING = 4
+MESSAGE_CHAR_WIDTH = 7
+
+# Upper bound on events applied per frame so a burst cannot stall rendering
+EVENTS_PER_FRAME = 1_000
+
+# Rows shown at once; longer rosters scroll inside the listbox
+CONTACT_LIST_ROWS = 28
+# Minimum time between two updates of the listbox items
+CONTACT_LIST_SECONDS = 0.1
+ONLINE_MARKER = "* "
+
+SEARCH_RESULT_ROWS = 10
+SEARCH_RESULT_CHARS = 40
+
+
+class MessageView:
+    """Renders the slice of a history that is visible in MESSAGE_GROUP.
+
+    Rows outside the visible slice are represented by two spacers whose
+    heights come from cached (measured or estimated) row heights, so the
+    scrollbar behaves as if every loaded message was drawn. Older messages
+    are loaded a page at a time when scrolling to the top, and dropped again
+    while the view follows the newest message.
+    """
+
+    def __init__(self) -> None:
+        self.history: History | None = None
+        self.first = 0  # index of the oldest loaded message
+        self.start = 0  # rendered slice is messages[start:stop]
+        self.stop = 0
+        # keyed by Message.key
+        self.items: dict[bytes | str, int | str] = {}
+        self.heights: dict[bytes | str, float] = {}
+        self.measured: set[bytes | str] = set()
+        # offsets[i] is the y position of messages[first + i]
+        self.offsets: list[float] = [0.0]
+        self.dirty_from: int | None = None
+        self.scroll = 0.0
+        self.remeasure = False
+        self.top_spacer: int | str = 0
+        self.bottom_spacer: int | str = 0
+
+    def _height(self, message: Message, width: int) -> float:
+        if (height := self.heights.get(message.key)) is None:
+            wrap = max(width - MESSAGE_INDENT, MESSAGE_CHAR_WIDTH)
+            lines = sum(
+                max(1, math.ceil(len(line) * MESSAGE_CHAR_WIDTH / wrap))
+                for line in message.as_string().split("\n")
+            )
+            height = lines * MESSAGE_LINE_HEIGHT + MESSAGE_ITEM_SPACING
+            self.heights[message.key] = height
+        return height
+
+    def _shift(self, count: int) -> None:
+        """Moves the loaded indices after count messages were loaded (or,
+        when negative, unloaded) at the front of the history."""
+        self.first += count
+        self.start += count
+        self.stop += count
+        if self.dirty_from is not None:
+            self.dirty_from += count
+
+    def _invalidate(self, index: int) -> None:
+        if self.dirty_from is None or index < self.dirty_from:
+            self.dirty_from = index
+
+    def _set_first(self, history: History, first: int) -> None:
+        self.first = first
+        self.offsets = [0.0]
+        self.dirty_from = first
+        loaded = history.messages[first:]
+        keep = {message.key for message in loaded}
+        self.heights = {
+            key: height for key, height in self.heights.items() if key in keep
+        }
+        self.measured &= keep
+
+    def _update_offsets(self, history: History, width: int) -> None:
+        loaded_end = self.first + len(self.offsets) - 1
+        if self.dirty_from is not None:
+            loaded_end = min(loaded_end, self.dirty_from)
+            del self.offsets[loaded_end - self.first + 1 :]
+            self.dirty_from = None
+        total = self.offsets[-1]
+        for message in history.messages[loaded_end:]:
+            total += self._height(message, width)
+            self.offsets.append(total)
+
+    def _measure_rendered(self, history: History) -> None:
+        for index in range(self.start, self.stop):
+            key = history.messages[index].key
+            if key in self.measured:
+                continue
+            height = dpg.get_item_rect_size(self.items[key])[1]
+            if height > 0:
+                self.measured.add(key)
+                height += MESSAGE_ITEM_SPACING
+                if height != self.heights.get(key):
+                    self.heights[key] = height
+                    self._invalidate(index)
+
+    def _add_item(
+        self, message: Message, width: int, before: int | str
+    ) -> None:
+        if message.is_sent_by_me():
+            indent, color = MESSAGE_INDENT, COLOR_MESSAGE_OTHERS
+        else:
+            indent, color = 0, COLOR_MESSAGE_ME
+        self.items[message.key] = dpg.add_text(
+            message.as_string(),
+            parent=MESSAGE_GROUP,
+            before=before,
+            indent=indent,
+            wrap=width - MESSAGE_INDENT,
+            color=color,
+        )
+        self.remeasure = True
 
-def get_team_prefix(label: str) -> str:
-    return label.split("(")[0]
-
+    def _delete_items(self, messages: Sequence[Message]) -> None:
+        for message in messages:
+            if (item := self.items.pop(message.key, None)) is not None:
+                dpg.delete_item(item)
 
-class Message:
-    def __init__(
-        self,
-        sender: str,
-        receiver: str,
-        message: str,
-        message_uuid: str,
-        sent_by_me: bool,
+    def _reset(self, history: History) -> None:
+        dpg.delete_item(MESSAGE_GROUP, children_only=True)
+        if self.history is not None:
+            self.history.trim(MESSAGE_PAGE_SIZE)
+        self.history = history
+        self.start = self.stop = len(history.messages)
+        self.items.clear()
+        self.heights.clear()
+        self.measured.clear()
+        self._set_first(
+            history, max(0, len(history.messages) - MESSAGE_PAGE_SIZE)
+        )
+        self.top_spacer = dpg.add_spacer(parent=MESSAGE_GROUP, height=0)
+        self.bottom_spacer = dpg.add_spacer(parent=MESSAGE_GROUP, height=0)
+        history.pop_status_changes()
+
+    def _visible_range(self, scroll: float) -> tuple[int, int]:
+        top = max(0.0, scroll - MESSAGE_VIEW_MARGIN)
+        bottom = scroll + MESSAGE_WINDOW_HEIGHT + MESSAGE_VIEW_MARGIN
+        start = max(0, bisect_right(self.offsets, top) - 1)
+        stop = min(len(self.offsets) - 1, bisect_right(self.offsets, bottom))
+        return self.first + start, self.first + stop
+
+    def _render_range(
+        self, history: History, width: int, start: int, stop: int
     ) -> None:
-        self.sender = sender
-        self.message = message
-        self.receiver = receiver
-        self.uuid = message_uuid
-        self.send_status = None
-        self.receive_status = None
-        self.sent_by_me = sent_by_me
-
-    def as_string(self) -> str:
-        if self.send_status is not None:
-            return f"{self.sender}:\n  {self.message}\n ({self.send_status})"
-        return self.sender + ":\n  " + self.message
-
-    def set_send_status(self, send_status: str) -> None:
-        self.send_status = send_status
-
-    def is_sent_by_me(self) -> bool:
-        return self.sent_by_me
-
-    def is_read(self) -> bool:
-        return self.receive_status == RECEIVE_STATUS_READ
-
-    def mark_as_read(self) -> None:
-        self.receive_status = RECEIVE_STATUS_READ
-
-    @staticmethod
-    def create_message(sender: str, receiver: str, message: str) -> Message:
-        return Message(sender, receiver, message, uuid.uuid4().hex, True)
-
-
-class History:
-    def __init__(self, contact: str) -> None:
-        self.contact = contact
-        self.messages: list[Message] = []
-        self.messages_by_uuid: dict[str, Message] = {}
-        self.typing = False
-        self.unread = 0
-
-    def add_message(self, message: Message) -> None:
-        self.messages.append(message)
-        self.messages_by_uuid[message.uuid] = message
-        self.unread = self.unread + 1
-
-    def set_message_status(self, message_uuid: str, status: str) -> None:
-        if message_uuid in self.messages_by_uuid:
-            self.messages_by_uuid[message_uuid].set_send_status(status)
-
-    def _get_rows(self) -> Sequence[Sequence[str]]:
-        return [[message.as_string()] for message in self.messages]
-
-    def set_typing(self, typing: bool) -> None:
-        self.typing = typing
-
-    def is_typing(self) -> bool:
-        return self.typing
-
-    def get_unread_messages(self) -> int:
-        return self.unread
-
-    def mark_as_read(self) -> Sequence[str]:
-        receipts: list[str] = []
-        for message in self.messages:
-            if not (message.is_sent_by_me() or message.is_read()):
-                receipts.append(message.uuid)
-                message.mark_as_read()
-        self.unread = 0
-        return receipts
-
-    def __str__(self) -> str:
-        if self.unread:
-            return f"{self.contact}({self.unread})"
-        return self.contact
-
-
-class Data:
-    def __init__(self, contacts: Sequence[str], myself: str) -> None:
-        if myself not in contacts:
-            raise ValueError(
-                f"The value for parameter 'myself' is {myself}, but it needs "
-                f"to be one of the registered names {contacts}."
-            )
+        messages = history.messages
+        if start >= self.stop or stop <= self.start:
+            self._delete_items(messages[self.start : self.stop])
+            self.start = self.stop = start
+        self._delete_items(messages[self.start : min(start, self.stop)])
+        self._delete_items(messages[max(stop, self.start) : self.stop])
+        if start < self.start:
+            before = self.items[messages[self.start].key]
+            for message in messages[start : self.start]:
+                self._add_item(message, width, before)
+        for message in messages[max(start, self.stop) : stop]:
+            self._add_item(message, width, self.bottom_spacer)
+        self.start, self.stop = start, stop
+
+    def needs_update(self) -> bool:
+        """True when the user scrolled or new rows have not been measured."""
+        return self.remeasure or dpg.get_y_scroll(MESSAGE_GROUP) != self.scroll
+
+    def update(self, history: History) -> None:
+        width = dpg.get_item_width(MESSAGE_GROUP)
+        if not isinstance(width, int):
+            return
+        if history is not self.history:
+            self._reset(history)
+        self.remeasure = False
+
+        for key in history.pop_status_changes():
+            # the row grows a status line; re-measure it once it is drawn
+            self.measured.discard(key)
+            if (item := self.items.get(key)) is not None:
+                message = history.messages_by_uuid[key]
+                dpg.set_value(item, message.as_string())
+                self.remeasure = True
+        self._measure_rendered(history)
+
+        scroll = dpg.get_y_scroll(MESSAGE_GROUP)
+        scroll_max = dpg.get_y_scroll_max(MESSAGE_GROUP)
+        follow = scroll >= scroll_max - MESSAGE_LINE_HEIGHT
+        if follow:
+            newest_page = len(history.messages) - MESSAGE_PAGE_SIZE
+            if self.first < newest_page - MESSAGE_PAGE_SIZE:
+                # rendered rows before the newest page are about to go
+                self._delete_items(
+                    history.messages[self.start : min(self.stop, newest_page)]
+                )
+                self.start = max(self.start, newest_page)
+                self.stop = max(self.stop, self.start)
+                self._set_first(history, newest_page)
+                self._shift(-history.trim(len(history.messages) - self.first))
+        elif (
+            scroll_max > 0
+            and scroll <= MESSAGE_LINE_HEIGHT
+            and (self.first or history.has_older)
+        ):
+            if not self.first:
+                self._shift(history.load_older(MESSAGE_PAGE_SIZE))
+            # keep the rows on screen in place while the page is prepended
+            self._update_offsets(history, width)
+            old_height = self.offsets[-1]
+            self._set_first(history, max(0, self.first - MESSAGE_PAGE_SIZE))
+            self._update_offsets(history, width)
+            scroll += self.offsets[-1] - old_height
+            dpg.set_y_scroll(MESSAGE_GROUP, scroll)
+        self._update_offsets(history, width)
+
+        total = self.offsets[-1]
+        if follow:
+            scroll = max(0.0, total - MESSAGE_WINDOW_HEIGHT)
+        start, stop = self._visible_range(scroll)
+        self._render_range(history, width, start, stop)
+        dpg.configure_item(
+            self.top_spacer, height=self.offsets[start - self.first]
+        )
+        dpg.configure_item(
+            self.bottom_spacer, height=total - self.offsets[stop - self.first]
+        )
+        if follow:
+            dpg.set_y_scroll(MESSAGE_GROUP, total)
+        self.scroll = dpg.get_y_scroll(MESSAGE_GROUP)
+
+
+class ContactList:
+    """Listbox model of the roster, most recently active contact first.
+
+    Labels are only recomputed for contacts marked as changed, and
+    update() reports whether any label or the order changed, so that the
+    listbox is only reconfigured then. Contacts added to the roster are
+    appended below the others.
+    """
+
+    def __init__(self, data: Data) -> None:
+        self.data = data
+        # contact -> label, least recently active first
+        self.order: OrderedDict[str, str] = OrderedDict()
+        self.contact_by_label: dict[str, str] = {}
+        self.relabel: set[str] = set()
+        self.touched: dict[str, None] = {}
+        self.changed = False
 
-        self.contacts = contacts
-        self.histories: list[History] = []
-        self.history_by_contact: dict[str, History] = {}
-        self.myself = myself
-        for contact in contacts:
-            history = History(contact)
-            self.history_by_contact[contact] = history
-            self.histories.append(history)
+    def _label(self, contact: str) -> str:
+        label = contact
+        if unread := self.data.unread(contact):
+            label = f"{contact}({unread})"
+        if contact in self.data.online:
+            label = ONLINE_MARKER + label
+        return label
+
+    def mark(self, contact: str) -> None:
+        self.relabel.add(contact)
+
+    def touch(self, contact: str) -> None:
+        """Moves the contact to the top on the next update."""
+        self.touched.pop(contact, None)
+        self.touched[contact] = None
+        self.relabel.add(contact)
+
+    def update(self) -> bool:
+        for contact in self.data.contacts[len(self.order) :]:
+            self.order[contact] = ""
+            self.order.move_to_end(contact, last=False)
+            self.relabel.add(contact)
+            self.changed = True
+        for contact in self.touched:
+            if next(reversed(self.order)) != contact:
+                self.order.move_to_end(contact)
+                self.changed = True
+        self.touched.clear()
+        for contact in self.relabel:
+            if (label := self._label(contact)) == self.order[contact]:
+                continue
+            self.contact_by_label.pop(self.order[contact], None)
+            self.order[contact] = label
+            self.contact_by_label[label] = contact
+            self.changed = True
+        self.relabel.clear()
+        changed, self.changed = self.changed, False
+        return changed
 
-    def get_history_by_contact(self, contact: str) -> History | None:
-        if contact in self.history_by_contact:
-            return self.history_by_contact[contact]
-        return None
+    def items(self) -> list[str]:
+        return list(reversed(self.order.values()))
 
 
 class ChatGui:
+    """Dear PyGui view of a ChatSession, which owns the chat state."""
+
     def __init__(
         self,
         myself: str,
@@ -153,138 +357,168 @@ class ChatGui:
         on_type: Callable,
         on_read: Callable,
         typing_timeout_seconds: int = 3,
+        store: MessageStore | None = None,
+        on_broadcast: Callable | None = None,
+        contacts: Sequence[str] | None = None,
+        on_stop_typing: Callable | None = None,
+        search_index: SearchIndex | None = None,
     ) -> None:
-        contacts = (
-            [f"team{i}a" for i in range(1, 13)]
-            + [f"team{i}b" for i in range(1, 13)]
-            + [f"x{i}" for i in range(1, 7)]
+        self.session = ChatSession(
+            myself,
+            on_send,
+            on_type,
+            on_read,
+            typing_timeout_seconds,
+            store,
+            on_broadcast,
+            contacts,
+            events=EventQueue(),
+            on_stop_typing=on_stop_typing,
+            search_index=search_index,
         )
-        if myself not in contacts:
-            raise ValueError(
-                f"The value for parameter 'myself' is {myself}, but it needs "
-                f"to be one of the registered names {contacts}."
-            )
-        contacts.remove(myself)
-        self.data = Data(contacts, myself)
-        self.changed = False
-        self.last_update: float = time.time()
-        self.typing_timestamps: dict[str, float | None] = {}
-        self.on_send = on_send
-        self.on_type = on_type
-        self.on_read = on_read
-        self.typing_timeout_seconds = typing_timeout_seconds
+        self.session.add_listener(self._on_session_event)
+        self.data = self.session.data
+        self.events = self.session.events
+        self.dirty: set[str] = set()
+        self.contact_list = ContactList(self.data)
+        self.contact_list_due = 0.0
+        self.selected: str | None = None
+        self.message_view = MessageView()
+        self.search_results: dict[str, str] = {}  # label -> contact
+
+    def _on_session_event(self, kind: str, contact: str) -> None:
+        self.dirty.add(contact)
+        if kind in (EVENT_MESSAGE, EVENT_SENT):
+            self.contact_list.touch(contact)
+        else:
+            self.contact_list.mark(contact)
 
     def receive(self, sender: str, message: str, message_uuid: str) -> None:
-        if history := self.data.get_history_by_contact(sender):
-            history.add_message(
-                Message(sender, self.data.myself, message, message_uuid, False)
-            )
-            self.changed = True
+        self.session.receive(sender, message, message_uuid)
 
     def send(self, receiver: str, message_body: str) -> None:
-        message = Message.create_message(
-            self.data.myself, receiver, message_body
-        )
-        if history := self.data.get_history_by_contact(receiver):
-            history.add_message(message)
-            # forward to callback
-            self.on_send(
-                self.data.myself, receiver, message.message, message.uuid
-            )
+        self.session.send(receiver, message_body)
+
+    def send_to_all(self, message_body: str) -> None:
+        self.session.send_to_all(message_body)
 
     def typing(self, sender: str) -> None:
-        if history := self.data.get_history_by_contact(sender):
-            history.set_typing(True)
-            self.changed = True
+        self.session.typing(sender)
+
+    def typing_stopped(self, sender: str) -> None:
+        self.session.typing_stopped(sender)
 
     def receipt_read(self, sender: str, message_uuid: str) -> None:
-        if history := self.data.get_history_by_contact(sender):
-            history.set_message_status(message_uuid, SEND_RECEIPT_READ)
-            self.changed = True
+        self.session.receipt_read(sender, message_uuid)
 
     def receipt_delivered(self, sender: str, message_uuid: str) -> None:
-        if history := self.data.get_history_by_contact(sender):
-            history.set_message_status(message_uuid, SEND_RECEIPT_DELIVERED)
-            self.changed = True
+        self.session.receipt_delivered(sender, message_uuid)
+
+    def presence(self, sender: str, online: bool) -> None:
+        self.session.presence(sender, online)
+
+    def process_events(self) -> None:
+        self.session.process_events(EVENTS_PER_FRAME)
+
+    def update_contact_list(self) -> None:
+        """Pushes the contact list to the listbox if it changed, at most
+        every CONTACT_LIST_SECONDS."""
+        now = time.monotonic()
+        if now < self.contact_list_due or not self.contact_list.update():
+            return
+        self.contact_list_due = now + CONTACT_LIST_SECONDS
+        items = self.contact_list.items()
+        dpg.configure_item(
+            CONTACT_LIST,
+            items=items,
+            num_items=min(len(items), CONTACT_LIST_ROWS),
+        )
+        if self.selected is not None:
+            dpg.set_value(CONTACT_LIST, self.contact_list.order[self.selected])
+
+    def select(self, contact: str) -> None:
+        if contact not in self.data.index:
+            return
+        self.selected = contact
+        self.dirty.add(contact)
+        if (label := self.contact_list.order.get(contact)) is not None:
+            dpg.set_value(CONTACT_LIST, label)
 
     def call_list(self, sender: Any, data: Any) -> None:
-        self.changed = True
+        if (
+            contact := self.contact_list.contact_by_label.get(data)
+        ) is not None:
+            self.select(contact)
+
+    def call_search(self, sender: Any, query: str) -> None:
+        self.search_results = {
+            f"{contact}: {message.message}"[:SEARCH_RESULT_CHARS]: contact
+            for contact, message in self.session.search(query)
+        }
+        items = list(self.search_results)
+        dpg.configure_item(
+            SEARCH_RESULTS,
+            items=items,
+            num_items=min(len(items), SEARCH_RESULT_ROWS),
+            show=bool(items),
+        )
+
+    def call_search_result(self, sender: Any, label: str) -> None:
+        if (contact := self.search_results.get(label)) is not None:
+            self.select(contact)
 
     def call_send_button(
         self, sender: Any, app_data: Any, user_data: bool
     ) -> None:
         message: str = dpg.get_value(MESSAGE_INPUT)
-        receiver: str = dpg.get_value(CONTACT_LIST)
         send_to_all = user_data
-        self.typing_timestamps[receiver] = None
         dpg.set_value(MESSAGE_INPUT, "")
         if send_to_all:
-            for receiver in self.data.contacts:
-                self.send(receiver, message)
-        else:
-            self.send(receiver, message)
-        self.changed = True
+            self.send_to_all(message)
+        elif self.selected is not None:
+            self.send(self.selected, message)
 
     def call_write(self, sender_widget: Any, data: Any) -> None:
-        index = dpg.get_value(CONTACT_LIST)
-        if (receiver := self.data.get_history_by_contact(index)) is None:
+        if self.selected is None:
             return
-        receiver = receiver.contact
-        now = time.time()
-        if receiver in self.typing_timestamps:
-            last_timestamp = self.typing_timestamps[receiver]
-            if (last_timestamp is not None) and (
-                now - last_timestamp < self.typing_timeout_seconds
-            ):
-                return
-        self.typing_timestamps[receiver] = now
-        # call typing callback
-        self.on_type(self.data.myself, receiver)
+        if data.strip():
+            self.session.write(self.selected)
+        else:
+            self.session.stop_typing(self.selected)
 
     def show_history_messages(self, history: History) -> None:
-        dpg.delete_item(MESSAGE_GROUP, children_only=True)
-        width = dpg.get_item_width(MESSAGE_GROUP)
-        for message in history.messages:
-            if not isinstance(width, int):
-                continue
-            if message.is_sent_by_me():
-                dpg.add_text(
-                    message.as_string(),
-                    parent=MESSAGE_GROUP,
-                    indent=MESSAGE_INDENT,
-                    wrap=width - MESSAGE_INDENT,
-                    color=COLOR_MESSAGE_OTHERS,
-                )
-            else:
-                dpg.add_text(
-                    message.as_string(),
-                    parent=MESSAGE_GROUP,
-                    indent=0,
-                    wrap=width - MESSAGE_INDENT,
-                    color=COLOR_MESSAGE_ME,
-                )
+        self.message_view.update(history)
 
     def update_table(self) -> None:
-        contact = dpg.get_value(CONTACT_LIST)
-        contact = get_team_prefix(contact)
-        # history = dpg.get_value(CONTACT_LIST)
+        if (contact := self.selected) is None:
+            return
+        self.dirty.discard(contact)
         if (history := self.data.get_history_by_contact(contact)) is None:
             return
-        for message_uuid in history.mark_as_read():
-            self.on_read(self.data.myself, history.contact, message_uuid)
+        if self.session.mark_as_read(contact):
+            self.contact_list.mark(contact)
         if history.is_typing():
             dpg.set_value(STATUS_LABEL, f"{history.contact} is typing...")
-            history.set_typing(False)
         else:
             dpg.set_value(STATUS_LABEL, "")
         self.show_history_messages(history)
 
     def main_callback(self) -> None:
-        if (self.last_update + 1 < time.time()) or self.changed:
-            self.changed = False
-            self.last_update = time.time()
+        if self.events:
+            self.process_events()
+        self.session.expire_typing()
+        self.data.store.flush(force=False)
+        self.data.update_search_index()
+        contact = self.selected
+        if contact in self.dirty:
             self.update_table()
-            # dpg.set_value(CONTACT_LIST, self.data.histories)
+        elif (
+            contact is not None
+            and self.message_view.needs_update()
+            and (history := self.data.get_history_by_contact(contact))
+        ):
+            self.show_history_messages(history)
+        self.update_contact_list()
 
     def _show_gui(self) -> None:
         with dpg.window(
@@ -296,13 +530,24 @@ class ChatGui:
                 with dpg.child_window(
                     width=CONTACT_LIST_WIDTH, height=MAIN_WINDOW_HEIGHT
                 ):
+                    dpg.add_input_text(
+                        tag=SEARCH_INPUT,
+                        width=-1,
+                        hint="Search...",
+                        callback=self.call_search,
+                        show=self.data.search_index is not None,
+                    )
+                    dpg.add_listbox(
+                        tag=SEARCH_RESULTS,
+                        items=[],
+                        width=-1,
+                        callback=self.call_search_result,
+                        show=False,
+                    )
                     dpg.add_listbox(
                         tag=CONTACT_LIST,
-                        items=[
-                            str(history) for history in self.data.histories
-                        ],
+                        items=[],
                         width=-1,
-                        num_items=len(self.data.contacts),
                         callback=self.call_list,
                     )
                 with dpg.group(horizontal=False):
@@ -340,6 +585,7 @@ class ChatGui:
                             callback=self.call_send_button,
                             user_data=True,  # send all
                         )
+        self.update_contact_list()
 
     def show(self) -> None:
         dpg.create_context()
@@ -356,3 +602,4 @@ class ChatGui:
             self.main_callback()
             dpg.render_dearpygui_frame()
         dpg.destroy_context()
+        self.session.close()
@@ -0,0 +1,708 @@
+from __future__ import annotations
+
+import heapq
+import sys
+import time
+import uuid
+from collections.abc import Callable, Sequence
+from enum import IntEnum
+
+from chat_store import MessageStore, StoredMessage
+from event_queue import (
+    EVENT_DELIVERED,
+    EVENT_MESSAGE,
+    EVENT_PRESENCE,
+    EVENT_READ,
+    EVENT_TYPING,
+    EVENT_TYPING_STOPPED,
+    ChatEvent,
+    EventQueue,
+)
+from search_index import SEARCH_LIMIT, SearchIndex
+
+
+class MessageStatus(IntEnum):
+    NONE = 0
+    DELIVERED = 1
+    READ = 2
+
+    def __str__(self) -> str:
+        return self.name.lower()
+
+
+SEND_RECEIPT_READ = MessageStatus.READ
+SEND_RECEIPT_DELIVERED = MessageStatus.DELIVERED
+
+RECEIVE_STATUS_READ = MessageStatus.READ
+
+BROADCAST_RECEIVER = "all"
+
+# Default roster; presence messages and new senders extend it at runtime
+CONTACTS = (
+    [f"team{i}a" for i in range(1, 13)]
+    + [f"team{i}b" for i in range(1, 13)]
+    + [f"x{i}" for i in range(1, 7)]
+)
+
+# Messages loaded per page, see History.load_older
+MESSAGE_PAGE_SIZE = 100
+
+# Stored messages read at a time when the search index catches up, and
+# the time per call of Data.update_search_index spent on it
+SEARCH_CATCH_UP_PAGE_SIZE = 500
+SEARCH_CATCH_UP_SECONDS = 0.008
+# The search index is saved once this many messages were added since the
+# last snapshot, at most every SEARCH_SAVE_SECONDS, so that after a crash
+# only the messages after the snapshot are indexed again
+SEARCH_SAVE_MESSAGES = 10_000
+SEARCH_SAVE_SECONDS = 300.0
+
+# Listener event for messages sent by this session, next to the EVENT_*
+# kinds of incoming events
+EVENT_SENT = "sent"
+
+# How long a typing notification shows, unless it is refreshed, stopped or
+# followed by a message; senders refresh every typing_timeout_seconds
+TYPING_TTL_SECONDS = 5.0
+# Minimum time between two typing notifications to the same receiver
+TYPING_MIN_SECONDS = 1.0
+
+PRESENCE_ONLINE = "online"
+PRESENCE_OFFLINE = "offline"
+
+Listener = Callable[[str, str], None]
+
+
+def pack_uuid(message_uuid: str) -> bytes | str:
+    """Packs a lowercase hex uuid into 16 bytes; other ids are kept as is."""
+    if len(message_uuid) == 32:
+        try:
+            packed = bytes.fromhex(message_uuid)
+        except ValueError:
+            return message_uuid
+        if packed.hex() == message_uuid:
+            return packed
+    return message_uuid
+
+
+def parse_status(status: str | None) -> MessageStatus:
+    if status is None:
+        return MessageStatus.NONE
+    return MessageStatus[status.upper()]
+
+
+class Message:
+    __slots__ = (
+        "sender",
+        "receiver",
+        "message",
+        "key",
+        "send_status",
+        "receive_status",
+        "sent_by_me",
+        "seq",
+        "recipient_status",
+    )
+
+    def __init__(
+        self,
+        sender: str,
+        receiver: str,
+        message: str,
+        message_uuid: str,
+        sent_by_me: bool,
+    ) -> None:
+        self.sender = sys.intern(sender)
+        self.message = message
+        self.receiver = sys.intern(receiver)
+        self.key = pack_uuid(message_uuid)
+        self.send_status = MessageStatus.NONE
+        self.receive_status = MessageStatus.NONE
+        self.sent_by_me = sent_by_me
+        self.seq: int | None = None
+        # per recipient send status, only for broadcast messages; shared
+        # by the copies of a broadcast in each recipient's history
+        self.recipient_status: dict[str, MessageStatus] | None = None
+
+    @property
+    def uuid(self) -> str:
+        if isinstance(self.key, bytes):
+            return self.key.hex()
+        return self.key
+
+    def as_string(self) -> str:
+        if self.recipient_status is not None:
+            statuses = self.recipient_status.values()
+            read = sum(status == MessageStatus.READ for status in statuses)
+            delivered = sum(bool(status) for status in statuses)
+            return (
+                f"{self.sender} (to all):\n  {self.message}\n"
+                f" (delivered {delivered}/{len(statuses)}, read {read})"
+            )
+        if self.send_status:
+            return f"{self.sender}:\n  {self.message}\n ({self.send_status})"
+        return self.sender + ":\n  " + self.message
+
+    def set_send_status(
+        self, send_status: MessageStatus, recipient: str | None = None
+    ) -> None:
+        # receipts may arrive out of order, never downgrade read
+        self.send_status = max(self.send_status, send_status)
+        if self.recipient_status is not None and recipient is not None:
+            previous = self.recipient_status.get(recipient, MessageStatus.NONE)
+            self.recipient_status[recipient] = max(previous, send_status)
+
+    def is_sent_by_me(self) -> bool:
+        return self.sent_by_me
+
+    def is_read(self) -> bool:
+        return self.receive_status == RECEIVE_STATUS_READ
+
+    def mark_as_read(self) -> None:
+        self.receive_status = RECEIVE_STATUS_READ
+
+    @staticmethod
+    def from_stored(row: StoredMessage) -> Message:
+        message = Message(
+            row.sender,
+            row.receiver,
+            row.message,
+            row.uuid,
+            bool(row.sent_by_me),
+        )
+        message.send_status = parse_status(row.send_status)
+        message.receive_status = parse_status(row.receive_status)
+        message.seq = row.seq
+        return message
+
+    def copy(self) -> Message:
+        """A copy with its own seq and send status, for another history."""
+        message = Message(
+            self.sender,
+            self.receiver,
+            self.message,
+            self.uuid,
+            self.sent_by_me,
+        )
+        message.send_status = self.send_status
+        message.receive_status = self.receive_status
+        message.recipient_status = self.recipient_status
+        return message
+
+    @staticmethod
+    def create_message(sender: str, receiver: str, message: str) -> Message:
+        return Message(sender, receiver, message, uuid.uuid4().hex, True)
+
+    @staticmethod
+    def create_broadcast(
+        sender: str, recipients: Sequence[str], message: str
+    ) -> Message:
+        broadcast = Message.create_message(sender, BROADCAST_RECEIVER, message)
+        broadcast.recipient_status = dict.fromkeys(
+            recipients, MessageStatus.NONE
+        )
+        return broadcast
+
+
+class History:
+    __slots__ = (
+        "contact",
+        "store",
+        "messages",
+        "messages_by_uuid",
+        "status_changes",
+        "typing_until",
+        "oldest_seq",
+        "has_older",
+        "unread_keys",
+        "search_index",
+    )
+
+    def __init__(
+        self,
+        contact: str,
+        store: MessageStore | None = None,
+        search_index: SearchIndex | None = None,
+    ) -> None:
+        self.contact = contact
+        self.store = store if store is not None else MessageStore()
+        self.search_index = search_index
+        self.messages: list[Message] = []
+        # keyed by Message.key, see pack_uuid
+        self.messages_by_uuid: dict[bytes | str, Message] = {}
+        # a dict of keys, smaller than a set while empty
+        self.status_changes: dict[bytes | str, None] = {}
+        self.typing_until = 0.0  # time.monotonic() deadline
+        self.oldest_seq: int | None = None
+        self.has_older = self.store.persistent
+        self.messages = self._restore(
+            self.store.load_recent(contact, MESSAGE_PAGE_SIZE)
+        )
+        # incoming messages not read yet, in arrival order; they need not
+        # be loaded, since the store tracks unread messages of its own
+        self.unread_keys: dict[bytes | str, None] = dict.fromkeys(
+            pack_uuid(message_uuid)
+            for message_uuid in self.store.unread_uuids(contact)
+        )
+
+    def _restore(self, stored: Sequence[StoredMessage]) -> list[Message]:
+        messages: list[Message] = []
+        for row in stored:
+            message = Message.from_stored(row)
+            self.messages_by_uuid[message.key] = message
+            messages.append(message)
+        if stored:
+            self.oldest_seq = stored[0].seq
+        return messages
+
+    def load_older(self, limit: int) -> int:
+        """Prepends up to limit older messages from the store."""
+        if not self.has_older or self.oldest_seq is None:
+            return 0
+        older = self._restore(
+            self.store.load_before(self.contact, self.oldest_seq, limit)
+        )
+        if len(older) < limit:
+            self.has_older = False
+        self.messages[:0] = older
+        return len(older)
+
+    def trim(self, keep: int) -> int:
+        """Unloads all but the newest keep messages, if they are stored."""
+        count = len(self.messages) - keep
+        if not self.store.persistent or count <= 0:
+            return 0
+        for message in self.messages[:count]:
+            del self.messages_by_uuid[message.key]
+            self.status_changes.pop(message.key, None)
+        del self.messages[:count]
+        self.oldest_seq = self.messages[0].seq if self.messages else None
+        self.has_older = True
+        return count
+
+    @property
+    def unread(self) -> int:
+        return len(self.unread_keys)
+
+    def add_message(self, message: Message) -> bool:
+        """Adds the message unless its uuid is already in the history."""
+        if message.key in self.messages_by_uuid:
+            return False
+        message.seq = self.store.append(
+            self.contact,
+            message.uuid,
+            message.sender,
+            message.receiver,
+            message.message,
+            message.is_sent_by_me(),
+        )
+        if message.seq is None and self.store.persistent:
+            return False  # already stored, but not loaded
+        if self.oldest_seq is None:
+            self.oldest_seq = message.seq
+        self.messages.append(message)
+        self.messages_by_uuid[message.key] = message
+        if not (message.is_sent_by_me() or message.is_read()):
+            self.unread_keys[message.key] = None
+        if self.search_index is not None:
+            self.search_index.add(
+                self.contact, message.key, message.message, message.seq
+            )
+        return True
+
+    def set_message_status(
+        self, message_uuid: str, status: MessageStatus
+    ) -> None:
+        self.store.update_status(self.contact, message_uuid, str(status))
+        key = pack_uuid(message_uuid)
+        if key in self.messages_by_uuid:
+            self.messages_by_uuid[key].set_send_status(status, self.contact)
+            self.status_changes[key] = None
+
+    def pop_status_changes(self) -> dict[bytes | str, None]:
+        changes = self.status_changes
+        self.status_changes = {}
+        return changes
+
+    def _get_rows(self) -> Sequence[Sequence[str]]:
+        return [[message.as_string()] for message in self.messages]
+
+    def is_typing(self) -> bool:
+        return self.typing_until > time.monotonic()
+
+    def get_unread_messages(self) -> int:
+        return self.unread
+
+    def mark_as_read(self) -> Sequence[str]:
+        if not self.unread_keys:
+            return []
+        receipts: list[str] = []
+        for key in self.unread_keys:
+            if (message := self.messages_by_uuid.get(key)) is not None:
+                message.mark_as_read()
+            receipts.append(key.hex() if isinstance(key, bytes) else key)
+        self.unread_keys.clear()
+        self.store.mark_read(self.contact, receipts, str(RECEIVE_STATUS_READ))
+        return receipts
+
+    def __str__(self) -> str:
+        if self.unread:
+            return f"{self.contact}({self.unread})"
+        return self.contact
+
+
+class Data:
+    """The roster of contacts and their histories.
+
+    Contacts can be added at any time, each gets the next row in contacts
+    and index. Histories are only created, and loaded from the store, when
+    they are first asked for; until then the unread count of a contact
+    comes from the store. A search index is brought up to date with the
+    stored messages it has not seen a little at a time, and saved now and
+    then, by calling update_search_index() regularly.
+    """
+
+    def __init__(
+        self,
+        contacts: Sequence[str],
+        myself: str,
+        store: MessageStore | None = None,
+        search_index: SearchIndex | None = None,
+    ) -> None:
+        if myself in contacts:
+            raise ValueError(
+                f"The value for parameter 'myself' is {myself}, but it must "
+                f"not be one of the contacts {contacts}."
+            )
+
+        self.contacts: list[str] = []
+        self.index: dict[str, int] = {}
+        self.history_by_contact: dict[str, History] = {}
+        self.online: set[str] = set()
+        self.myself = myself
+        self.store = store if store is not None else MessageStore()
+        self.stored_unread = self.store.unread_counts()
+        self.search_index = search_index
+        # until then, histories leave indexing their messages to the
+        # catch-up, which finds them in the store
+        self.search_caught_up = search_index is None
+        self.search_saved_at = time.monotonic()
+        for contact in contacts:
+            self.add_contact(contact)
+        for contact in self.stored_unread:
+            self.add_contact(contact)
+
+    def add_contact(self, contact: str) -> bool:
+        if contact in self.index or contact == self.myself:
+            return False
+        contact = sys.intern(contact)
+        self.index[contact] = len(self.contacts)
+        self.contacts.append(contact)
+        return True
+
+    def set_online(self, contact: str, online: bool) -> bool:
+        """Returns True if the contact is new or its presence changed."""
+        added = online and self.add_contact(contact)
+        if contact not in self.index or online == (contact in self.online):
+            return added
+        if online:
+            self.online.add(contact)
+        else:
+            self.online.discard(contact)
+        return True
+
+    def update_search_index(
+        self, seconds: float = SEARCH_CATCH_UP_SECONDS
+    ) -> bool:
+        """Indexes stored messages that the search index has not seen for
+        about seconds, or saves the index when due. Returns True once it
+        is up to date."""
+        index = self.search_index
+        if index is None:
+            return True
+        save = False
+        if not self.search_caught_up:
+            deadline = time.monotonic() + seconds
+            while True:
+                stored = self.store.load_after(
+                    index.last_seq, SEARCH_CATCH_UP_PAGE_SIZE
+                )
+                for contact, row in stored:
+                    index.add(
+                        contact, pack_uuid(row.uuid), row.message, row.seq
+                    )
+                if len(stored) < SEARCH_CATCH_UP_PAGE_SIZE:
+                    break
+                if time.monotonic() >= deadline:
+                    return False
+            self.search_caught_up = True
+            for history in self.history_by_contact.values():
+                history.search_index = index
+            # the catch-up is what a snapshot saves
+            save = index.unsaved > 0
+        elif index.unsaved >= SEARCH_SAVE_MESSAGES:
+            elapsed = time.monotonic() - self.search_saved_at
+            save = elapsed > SEARCH_SAVE_SECONDS
+        if save and index.path is not None:
+            index.save()
+            self.search_saved_at = time.monotonic()
+        return True
+
+    def get_history_by_contact(self, contact: str) -> History | None:
+        if (history := self.history_by_contact.get(contact)) is not None:
+            return history
+        if contact not in self.index:
+            return None
+        history = History(
+            self.contacts[self.index[contact]],
+            self.store,
+            self.search_index if self.search_caught_up else None,
+        )
+        self.history_by_contact[contact] = history
+        self.stored_unread.pop(contact, None)
+        return history
+
+    def unread(self, contact: str) -> int:
+        if (history := self.history_by_contact.get(contact)) is not None:
+            return history.unread
+        return self.stored_unread.get(contact, 0)
+
+
+class ChatSession:
+    """State and protocol logic of one chat client, without any GUI.
+
+    The network side calls receive(), typing() and the receipt methods,
+    the user side calls send(), send_to_all(), write(), stop_typing() and
+    mark_as_read(), and search() when there is a search index. Typing
+    indicators expire after TYPING_TTL_SECONDS when expire_typing() is
+    called, which is cheap enough to call every frame.
+    Outgoing traffic goes to the on_* callbacks like in ChatGui. Every
+    change to a contact is reported to the listeners as (kind, contact),
+    where kind is one of the EVENT_* kinds or EVENT_SENT.
+
+    Without an event queue, incoming events are applied right away in the
+    calling thread. With one, they are queued until process_events() is
+    called, so that a GUI can apply them from its own thread.
+    """
+
+    def __init__(
+        self,
+        myself: str,
+        on_send: Callable,
+        on_type: Callable,
+        on_read: Callable,
+        typing_timeout_seconds: float = 3,
+        store: MessageStore | None = None,
+        on_broadcast: Callable | None = None,
+        contacts: Sequence[str] | None = None,
+        events: EventQueue | None = None,
+        on_stop_typing: Callable | None = None,
+        search_index: SearchIndex | None = None,
+    ) -> None:
+        if contacts is None:
+            contacts = [contact for contact in CONTACTS if contact != myself]
+        self.data = Data(contacts, myself, store, search_index)
+        self.events = events
+        self.listeners: list[Listener] = []
+        # receiver side: (deadline, contact), stale entries are skipped
+        self.typing_expiry: list[tuple[float, str]] = []
+        # sender side: last notification per receiver, and those that
+        # have not been stopped or followed by a message since
+        self.typing_sent: dict[str, float] = {}
+        self.typing_announced: set[str] = set()
+        self.on_send = on_send
+        self.on_type = on_type
+        self.on_read = on_read
+        self.on_broadcast = on_broadcast
+        self.on_stop_typing = on_stop_typing
+        self.typing_timeout_seconds = typing_timeout_seconds
+
+    def add_listener(self, listener: Listener) -> None:
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener: Listener) -> None:
+        self.listeners.remove(listener)
+
+    def _notify(self, kind: str, contact: str) -> None:
+        for listener in self.listeners:
+            listener(kind, contact)
+
+    def _put(self, event: ChatEvent) -> None:
+        if self.events is None:
+            self._apply_event(event)
+        else:
+            self.events.put(event)
+
+    def receive(self, sender: str, message: str, message_uuid: str) -> None:
+        self._put(ChatEvent(EVENT_MESSAGE, sender, message, message_uuid))
+
+    def typing(self, sender: str) -> None:
+        self._put(ChatEvent(EVENT_TYPING, sender))
+
+    def typing_stopped(self, sender: str) -> None:
+        self._put(ChatEvent(EVENT_TYPING_STOPPED, sender))
+
+    def receipt_read(self, sender: str, message_uuid: str) -> None:
+        self._put(ChatEvent(EVENT_READ, sender, message_uuid=message_uuid))
+
+    def receipt_delivered(self, sender: str, message_uuid: str) -> None:
+        self._put(
+            ChatEvent(EVENT_DELIVERED, sender, message_uuid=message_uuid)
+        )
+
+    def presence(self, sender: str, online: bool) -> None:
+        status = PRESENCE_ONLINE if online else PRESENCE_OFFLINE
+        # the status travels in the message field
+        self._put(ChatEvent(EVENT_PRESENCE, sender, status))
+
+    def _apply_event(self, event: ChatEvent) -> None:
+        if event.kind == EVENT_PRESENCE:
+            online = event.message == PRESENCE_ONLINE
+            if self.data.set_online(event.sender, online):
+                self._notify(event.kind, event.sender)
+            return
+        if event.kind == EVENT_MESSAGE:
+            self.data.add_contact(event.sender)
+        if (history := self.data.get_history_by_contact(event.sender)) is None:
+            return
+        if event.kind == EVENT_MESSAGE:
+            message = Message(
+                event.sender,
+                self.data.myself,
+                event.message,
+                event.message_uuid,
+                False,
+            )
+            if not history.add_message(message):
+                return  # redelivered
+            history.typing_until = 0.0
+        elif event.kind == EVENT_TYPING:
+            history.typing_until = time.monotonic() + TYPING_TTL_SECONDS
+            heapq.heappush(
+                self.typing_expiry, (history.typing_until, history.contact)
+            )
+        elif event.kind == EVENT_TYPING_STOPPED:
+            if not history.typing_until:
+                return
+            history.typing_until = 0.0
+        elif event.kind == EVENT_READ:
+            history.set_message_status(event.message_uuid, SEND_RECEIPT_READ)
+        elif event.kind == EVENT_DELIVERED:
+            history.set_message_status(
+                event.message_uuid, SEND_RECEIPT_DELIVERED
+            )
+        self._notify(event.kind, history.contact)
+
+    def process_events(self, limit: int | None = None) -> int:
+        """Applies up to limit queued events, returns how many."""
+        if self.events is None:
+            return 0
+        batch = self.events.drain(limit)
+        for event in batch:
+            self._apply_event(event)
+        return len(batch)
+
+    def expire_typing(self) -> None:
+        now = time.monotonic()
+        while self.typing_expiry and self.typing_expiry[0][0] <= now:
+            deadline, contact = heapq.heappop(self.typing_expiry)
+            history = self.data.history_by_contact[contact]
+            if history.typing_until == deadline:
+                history.typing_until = 0.0
+                self._notify(EVENT_TYPING_STOPPED, contact)
+
+    def send(self, receiver: str, message_body: str) -> Message | None:
+        if (history := self.data.get_history_by_contact(receiver)) is None:
+            return None
+        message = Message.create_message(
+            self.data.myself, receiver, message_body
+        )
+        history.add_message(message)
+        # the message ends the typing indicator on the other side
+        self.typing_announced.discard(receiver)
+        self._notify(EVENT_SENT, receiver)
+        self.on_send(self.data.myself, receiver, message.message, message.uuid)
+        return message
+
+    def send_to_all(self, message_body: str) -> None:
+        if self.on_broadcast is None:
+            for receiver in self.data.contacts:
+                self.send(receiver, message_body)
+            return
+        message = Message.create_broadcast(
+            self.data.myself, self.data.contacts, message_body
+        )
+        self.typing_announced.clear()
+        # each history gets its own copy, since the store gives each its
+        # own seq and send status
+        for contact in self.data.contacts:
+            if history := self.data.get_history_by_contact(contact):
+                history.add_message(message.copy())
+                self._notify(EVENT_SENT, contact)
+        self.on_broadcast(self.data.myself, message.message, message.uuid)
+
+    def write(self, receiver: str) -> bool:
+        """Reports that the user types to receiver. The typing callback is
+        called again every typing_timeout_seconds while the user keeps
+        typing, and never within TYPING_MIN_SECONDS per receiver, also
+        not after a message or stop_typing()."""
+        if receiver not in self.data.index:
+            return False
+        now = time.monotonic()
+        if (last := self.typing_sent.get(receiver)) is not None:
+            elapsed = now - last
+            if elapsed < TYPING_MIN_SECONDS or (
+                receiver in self.typing_announced
+                and elapsed < self.typing_timeout_seconds
+            ):
+                return False
+        self.typing_sent[receiver] = now
+        self.typing_announced.add(receiver)
+        self.on_type(self.data.myself, receiver)
+        return True
+
+    def stop_typing(self, receiver: str) -> bool:
+        """Reports that the user stopped typing to receiver, for example by
+        clearing the input. Only the first call after write() reaches the
+        on_stop_typing callback."""
+        if receiver not in self.typing_announced:
+            return False
+        self.typing_announced.discard(receiver)
+        if self.on_stop_typing is not None:
+            self.on_stop_typing(self.data.myself, receiver)
+        return True
+
+    def mark_as_read(self, contact: str) -> Sequence[str]:
+        """Marks the contact's messages as read and sends the receipts."""
+        if (history := self.data.get_history_by_contact(contact)) is None:
+            return []
+        if receipts := history.mark_as_read():
+            self.on_read(self.data.myself, history.contact, receipts)
+        return receipts
+
+    def search(
+        self, query: str, contact: str | None = None, limit: int = SEARCH_LIMIT
+    ) -> list[tuple[str, Message]]:
+        """The newest (contact, message) pairs matching query, see
+        SearchIndex.search. Messages that are not loaded come from the
+        store, without being loaded into their history."""
+        if self.data.search_index is None:
+            return []
+        results: list[tuple[str, Message]] = []
+        for hit in self.data.search_index.search(query, contact, limit):
+            history = self.data.history_by_contact.get(hit.contact)
+            if history is not None and (
+                message := history.messages_by_uuid.get(hit.key)
+            ):
+                results.append((hit.contact, message))
+                continue
+            message_uuid = (
+                hit.key.hex() if isinstance(hit.key, bytes) else hit.key
+            )
+            row = self.data.store.load_message(hit.contact, message_uuid)
+            if row is not None:
+                results.append((hit.contact, Message.from_stored(row)))
+        return results
+
+    def close(self) -> None:
+        self.data.store.close()
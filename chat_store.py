@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import sqlite3
+import time
+from collections.abc import Sequence
+from typing import NamedTuple
+
+
+GROUP_COMMIT_SIZE = 256
+GROUP_COMMIT_SECONDS = 0.5
+
+
+class StoredMessage(NamedTuple):
+    seq: int
+    uuid: str
+    sender: str
+    receiver: str
+    message: str
+    sent_by_me: bool
+    send_status: str | None
+    receive_status: str | None
+
+
+class MessageStore:
+    """Storage backend behind History. This default keeps nothing, so
+    histories only live in memory and are lost on restart."""
+
+    persistent = False
+
+    def append(
+        self,
+        contact: str,
+        message_uuid: str,
+        sender: str,
+        receiver: str,
+        message: str,
+        sent_by_me: bool,
+    ) -> int | None:
+        return None
+
+    def update_status(
+        self, contact: str, message_uuid: str, send_status: str
+    ) -> None:
+        pass
+
+    def mark_read(
+        self, contact: str, message_uuids: Sequence[str], status: str
+    ) -> None:
+        pass
+
+    def load_recent(self, contact: str, limit: int) -> list[StoredMessage]:
+        return []
+
+    def load_before(
+        self, contact: str, seq: int, limit: int
+    ) -> list[StoredMessage]:
+        return []
+
+    def load_after(
+        self, seq: int, limit: int
+    ) -> list[tuple[str, StoredMessage]]:
+        """Messages of all contacts after seq, oldest first."""
+        return []
+
+    def load_message(
+        self, contact: str, message_uuid: str
+    ) -> StoredMessage | None:
+        return None
+
+    def unread_uuids(self, contact: str) -> list[str]:
+        return []
+
+    def unread_counts(self) -> dict[str, int]:
+        return {}
+
+    def flush(self, force: bool = True) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteStore(MessageStore):
+    """Append-only message table in an SQLite database in WAL mode.
+
+    Writes are executed immediately but committed in groups, either every
+    GROUP_COMMIT_SIZE writes or when flush() is called and the oldest
+    uncommitted write is GROUP_COMMIT_SECONDS old. Must be used from a
+    single thread.
+    """
+
+    persistent = True
+
+    def __init__(self, path: str) -> None:
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS messages (
+                seq INTEGER PRIMARY KEY,
+                contact TEXT NOT NULL,
+                uuid TEXT NOT NULL,
+                sender TEXT NOT NULL,
+                receiver TEXT NOT NULL,
+                message TEXT NOT NULL,
+                sent_by_me INTEGER NOT NULL,
+                send_status TEXT,
+                receive_status TEXT,
+                UNIQUE (contact, uuid)
+            );
+            CREATE INDEX IF NOT EXISTS messages_by_contact
+                ON messages (contact, seq);
+            CREATE INDEX IF NOT EXISTS unread_by_contact
+                ON messages (contact)
+                WHERE sent_by_me = 0 AND receive_status IS NULL;
+            """)
+        self.pending = 0
+        self.pending_since = 0.0
+
+    def _written(self) -> None:
+        if not self.pending:
+            self.pending_since = time.monotonic()
+        self.pending += 1
+        if self.pending >= GROUP_COMMIT_SIZE:
+            self.flush()
+
+    def append(
+        self,
+        contact: str,
+        message_uuid: str,
+        sender: str,
+        receiver: str,
+        message: str,
+        sent_by_me: bool,
+    ) -> int | None:
+        cursor = self.connection.execute(
+            "INSERT OR IGNORE INTO messages (contact, uuid, sender, receiver,"
+            " message, sent_by_me) VALUES (?, ?, ?, ?, ?, ?)",
+            (contact, message_uuid, sender, receiver, message, sent_by_me),
+        )
+        self._written()
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def update_status(
+        self, contact: str, message_uuid: str, send_status: str
+    ) -> None:
+        self.connection.execute(
+            "UPDATE messages SET send_status = ? WHERE contact = ?"
+            " AND uuid = ? AND coalesce(send_status, '') != 'read'",
+            (send_status, contact, message_uuid),
+        )
+        self._written()
+
+    def mark_read(
+        self, contact: str, message_uuids: Sequence[str], status: str
+    ) -> None:
+        self.connection.executemany(
+            "UPDATE messages SET receive_status = ? "
+            "WHERE contact = ? AND uuid = ?",
+            [
+                (status, contact, message_uuid)
+                for message_uuid in message_uuids
+            ],
+        )
+        self._written()
+
+    def _load(self, query: str, parameters: tuple) -> list[StoredMessage]:
+        rows = self.connection.execute(query, parameters).fetchall()
+        return [StoredMessage._make(row) for row in reversed(rows)]
+
+    def load_recent(self, contact: str, limit: int) -> list[StoredMessage]:
+        return self._load(
+            "SELECT seq, uuid, sender, receiver, message, sent_by_me,"
+            " send_status, receive_status FROM messages WHERE contact = ?"
+            " ORDER BY seq DESC LIMIT ?",
+            (contact, limit),
+        )
+
+    def load_before(
+        self, contact: str, seq: int, limit: int
+    ) -> list[StoredMessage]:
+        return self._load(
+            "SELECT seq, uuid, sender, receiver, message, sent_by_me,"
+            " send_status, receive_status FROM messages"
+            " WHERE contact = ? AND seq < ? ORDER BY seq DESC LIMIT ?",
+            (contact, seq, limit),
+        )
+
+    def load_after(
+        self, seq: int, limit: int
+    ) -> list[tuple[str, StoredMessage]]:
+        rows = self.connection.execute(
+            "SELECT contact, seq, uuid, sender, receiver, message, sent_by_me,"
+            " send_status, receive_status FROM messages WHERE seq > ?"
+            " ORDER BY seq LIMIT ?",
+            (seq, limit),
+        ).fetchall()
+        return [(row[0], StoredMessage._make(row[1:])) for row in rows]
+
+    def load_message(
+        self, contact: str, message_uuid: str
+    ) -> StoredMessage | None:
+        row = self.connection.execute(
+            "SELECT seq, uuid, sender, receiver, message, sent_by_me,"
+            " send_status, receive_status FROM messages"
+            " WHERE contact = ? AND uuid = ?",
+            (contact, message_uuid),
+        ).fetchone()
+        return StoredMessage._make(row) if row is not None else None
+
+    def unread_uuids(self, contact: str) -> list[str]:
+        rows = self.connection.execute(
+            "SELECT uuid FROM messages WHERE contact = ?"
+            " AND sent_by_me = 0 AND receive_status IS NULL",
+            (contact,),
+        ).fetchall()
+        return [message_uuid for (message_uuid,) in rows]
+
+    def unread_counts(self) -> dict[str, int]:
+        return dict(
+            self.connection.execute(
+                "SELECT contact, count(*) FROM messages"
+                " WHERE sent_by_me = 0 AND receive_status IS NULL"
+                " GROUP BY contact"
+            ).fetchall()
+        )
+
+    def flush(self, force: bool = True) -> None:
+        if not self.pending:
+            return
+        if (
+            force
+            or time.monotonic() - self.pending_since > GROUP_COMMIT_SECONDS
+        ):
+            self.connection.commit()
+            self.pending = 0
+
+    def close(self) -> None:
+        self.flush()
+        self.connection.close()
@@ -1,101 +1,294 @@
-import json
+import argparse
+import logging
+import threading
+from collections.abc import Sequence
 from typing import Any
 
 import paho.mqtt.client as mqtt
 
-from chat_gui import ChatGui
+from chat_gui import BROADCAST_RECEIVER, ChatGui
+from chat_session import PRESENCE_OFFLINE, PRESENCE_ONLINE
+from chat_store import SqliteStore
+from mqtt_async import AsyncMqttTransport
+from mqtt_connection import ConnectionManager
+from outbox import Outbox, SeenUuids
+from search_index import SearchIndex
+from topic_router import TopicRouter
+from wire_codec import encode_payload
 
 
-# Called by MQTT client when we are connected
+RECEIPT_BATCH_SECONDS = 0.05
+RECEIPT_BATCH_SIZE = 500
+
+# Drive the MQTT client from an asyncio event loop instead of loop_start()
+ASYNC_MODE = False
+
+# Send compact payloads to every contact, not only to those that have sent
+# us a compact payload and so are known to understand it
+COMPACT_WIRE = False
+
+LOGGER = logging.getLogger(__name__)
+
+
+def encode_for(receiver: str, payload_dict: dict[str, Any]) -> bytes:
+    return encode_payload(
+        payload_dict, COMPACT_WIRE or receiver in ROUTER.compact_peers
+    )
+
+
+def publish(
+    topic: str, payload: bytes, qos: int = 0, retain: bool = False
+) -> None:
+    """Publishes without blocking the caller in either transport mode."""
+    if TRANSPORT is not None:
+        TRANSPORT.publish_threadsafe(topic, payload, qos, retain)
+    else:
+        CONNECTION.publish(topic, payload, qos, retain)
+
+
+def congested() -> bool:
+    """True while earlier publishes still wait for the network."""
+    if TRANSPORT is not None:
+        return TRANSPORT.congested()
+    return not CONNECTION.connected or MQTTC.want_write()
+
+
+def publish_typing(kind: str, sender: str, receiver: str) -> None:
+    # typing is best effort: QoS 0, and dropped instead of queued behind
+    # messages and receipts when the connection is busy
+    if congested():
+        LOGGER.debug("Dropping %s %s --> %s", kind, sender, receiver)
+        return
+    payload = encode_for(receiver, {"sender": sender, "receiver": receiver})
+    publish(f"ttm4175/chat/{receiver}/{kind}", payload, qos=0)
+
+
+def presence_payload(status: str) -> bytes:
+    # always JSON, the compact format has no status field
+    return encode_payload({"sender": MY_ID, "status": status}, False)
+
+
+def receipt_payload(sender: str, receiver: str, uuids: Sequence[str]) -> bytes:
+    # "uuid" keeps single-receipt clients working, they see the newest one
+    payload_dict: dict[str, Any] = {
+        "sender": sender,
+        "receiver": receiver,
+        "uuid": uuids[-1],
+    }
+    if len(uuids) > 1:
+        payload_dict["uuids"] = list(uuids)
+    return encode_for(receiver, payload_dict)
+
+
+def receipt_uuids(data: dict) -> list[str]:
+    return data.get("uuids") or [data["uuid"]]
+
+
+def publish_receipts(
+    kind: str, sender: str, receiver: str, uuids: Sequence[str]
+) -> None:
+    for start in range(0, len(uuids), RECEIPT_BATCH_SIZE):
+        publish(
+            f"ttm4175/chat/{receiver}/{kind}",
+            receipt_payload(
+                sender, receiver, uuids[start : start + RECEIPT_BATCH_SIZE]
+            ),
+        )
+
+
+class ReceiptBatcher:
+    """Collects receipts per sender and receiver and publishes each batch
+    as one message RECEIPT_BATCH_SECONDS after its first receipt."""
+
+    def __init__(self, kind: str) -> None:
+        self.kind = kind
+        self.pending: dict[tuple[str, str], list[str]] = {}
+        self.lock = threading.Lock()
+        self.timer: threading.Timer | None = None
+
+    def add(self, sender: str, receiver: str, uuid: str) -> None:
+        with self.lock:
+            uuids = self.pending.setdefault((sender, receiver), [])
+            uuids.append(uuid)
+            if full := len(uuids) >= RECEIPT_BATCH_SIZE:
+                del self.pending[(sender, receiver)]
+            elif self.timer is None:
+                self.timer = threading.Timer(RECEIPT_BATCH_SECONDS, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        if full:
+            publish_receipts(self.kind, sender, receiver, uuids)
+
+    def flush(self) -> None:
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.timer = None
+        for (sender, receiver), uuids in pending.items():
+            publish_receipts(self.kind, sender, receiver, uuids)
+
+
+# Called by the ConnectionManager when we are (re)connected and subscribed
 def on_connect(mqttc: Any, obj: Any, flags: Any, rc: Any) -> None:
-    print(f"Connected: {rc}")
+    LOGGER.info("Connected: %s", rc)
+    publish(PRESENCE_TOPIC, presence_payload(PRESENCE_ONLINE), 1, True)
 
 
 # Called by the MQTT client for every message we receive
 def on_message(mqttc: mqtt.Client, obj: Any, msg: Any) -> None:
-    print(f"{msg.topic} {msg.qos} {msg.payload}")
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        LOGGER.debug("%s %s %s", msg.topic, msg.qos, msg.payload)
+    ROUTER.route(msg.topic, msg.payload)
 
-    try:
-        data = json.loads(msg.payload)
-    except json.JSONDecodeError as e:
-        print("The payload is not valid json!")
-        print(e)
-        return
 
-    print(msg.topic)
-    if msg.topic.endswith("message"):
+def handle_message(data: dict[str, Any]) -> None:
+    if data["sender"] == MY_ID:
+        return  # our own broadcast
+    if SEEN_UUIDS.add(data["uuid"]):
         GUI.receive(data["sender"], data["message"], data["uuid"])
-        # sending the delivery receipt, we switch sender and receiver
-        receiver = data["sender"]
-        sender = data["receiver"]
-        payload_dict = {
-            "sender": sender,
-            "receiver": receiver,
-            "uuid": data["uuid"],
-        }
-        payload_json = json.dumps(payload_dict)
-        mqttc.publish(
-            f"ttm4175/chat/{receiver}/delivered", payload=payload_json
-        )
-    elif msg.topic.endswith("delivered"):
-        GUI.receipt_delivered(data["sender"], data["uuid"])
-    elif msg.topic.endswith("read"):
-        GUI.receipt_read(data["sender"], data["uuid"])
-    elif msg.topic.endswith("typing"):
-        GUI.typing(data["sender"])
-    else:
-        print(f"Unknown topic: {msg.topic}")
+    # sending the delivery receipt, we switch sender and receiver; also
+    # for retransmissions, since the sender may have missed the first one
+    DELIVERED_RECEIPTS.add(MY_ID, data["sender"], data["uuid"])
+
+
+def handle_delivered(data: dict[str, Any]) -> None:
+    for uuid in receipt_uuids(data):
+        OUTBOX.acknowledge(uuid)
+        GUI.receipt_delivered(data["sender"], uuid)
+
+
+def handle_read(data: dict[str, Any]) -> None:
+    for uuid in receipt_uuids(data):
+        OUTBOX.acknowledge(uuid)
+        GUI.receipt_read(data["sender"], uuid)
+
+
+def handle_typing(data: dict[str, Any]) -> None:
+    GUI.typing(data["sender"])
+
+
+def handle_typing_stopped(data: dict[str, Any]) -> None:
+    GUI.typing_stopped(data["sender"])
+
+
+def handle_presence(data: dict[str, Any]) -> None:
+    if data["sender"] != MY_ID:
+        GUI.presence(data["sender"], data.get("status") == PRESENCE_ONLINE)
 
 
 # Called by the Chat UI when we want to send a message
 def on_send(sender: str, receiver: str, message: str, uuid: str) -> None:
-    print(f"Sending {sender} --> {receiver} {message[:5]}...")
+    LOGGER.info("Sending %s --> %s %s...", sender, receiver, message[:5])
     payload_dict = {
         "sender": sender,
         "receiver": receiver,
         "message": message,
         "uuid": uuid,
     }
-    payload_json = json.dumps(payload_dict)
-    MQTTC.publish(f"ttm4175/chat/{receiver}/message", payload=payload_json)
+    payload = encode_for(receiver, payload_dict)
+    OUTBOX.send(uuid, f"ttm4175/chat/{receiver}/message", payload)
 
 
-# Called by the Chat UI when we start typing to somebody
-def on_type(sender: str, receiver: str) -> None:
-    print(f"Typing: {sender} --> {receiver}")
+# Called by the Chat UI when we send one message to all contacts
+def on_broadcast(sender: str, message: str, uuid: str) -> None:
+    LOGGER.info("Broadcasting %s --> all %s...", sender, message[:5])
     payload_dict = {
         "sender": sender,
-        "receiver": receiver,
+        "receiver": BROADCAST_RECEIVER,
+        "message": message,
+        "uuid": uuid,
     }
-    payload_json = json.dumps(payload_dict)
-    MQTTC.publish(f"ttm4175/chat/{receiver}/typing", payload=payload_json)
+    payload = encode_payload(payload_dict, COMPACT_WIRE)
+    publish(BROADCAST_TOPIC, payload, qos=1)
 
 
-# Called by the Chat UI when we have read a message
-def on_read(sender: str, receiver: str, uuid: str) -> None:
-    print(f"Read: {sender} --> {receiver} {uuid[:5]}...")
-    payload_dict = {
-        "sender": sender,
-        "receiver": receiver,
-        "uuid": uuid,
-    }
-    payload_json = json.dumps(payload_dict)
-    MQTTC.publish(f"ttm4175/chat/{receiver}/read", payload=payload_json)
+# Called by the Chat UI when we start typing to somebody
+def on_type(sender: str, receiver: str) -> None:
+    LOGGER.info("Typing: %s --> %s", sender, receiver)
+    publish_typing("typing", sender, receiver)
+
+
+# Called by the Chat UI when we cleared the input after typing
+def on_stop_typing(sender: str, receiver: str) -> None:
+    LOGGER.info("Stopped typing: %s --> %s", sender, receiver)
+    publish_typing("typing_stopped", sender, receiver)
+
+
+# Called by the Chat UI when we have read one or more messages
+def on_read(sender: str, receiver: str, uuids: Sequence[str]) -> None:
+    LOGGER.info("Read: %s --> %s %d message(s)", sender, receiver, len(uuids))
+    publish_receipts("read", sender, receiver, uuids)
 
 
 MY_ID = "team5b"
-GUI = ChatGui(MY_ID, on_send=on_send, on_type=on_type, on_read=on_read)
-MQTTC = mqtt.Client()
+BROKER_HOST = "mqtt20.iik.ntnu.no"
+BROKER_PORT = 1883
+BROADCAST_TOPIC = f"ttm4175/chat/{BROADCAST_RECEIVER}/message"
+# retained, and set to offline by the broker through our last will
+PRESENCE_TOPIC = f"ttm4175/chat/{MY_ID}/presence"
+STORE_PATH = f"chat_history_{MY_ID}.sqlite3"
+OUTBOX_PATH = f"chat_outbox_{MY_ID}.sqlite3"
+# snapshot of the search index, brought up to date from the history on start
+SEARCH_INDEX_PATH = f"chat_search_{MY_ID}.index"
+GUI = ChatGui(
+    MY_ID,
+    on_send=on_send,
+    on_type=on_type,
+    on_read=on_read,
+    store=SqliteStore(STORE_PATH),
+    on_broadcast=on_broadcast,
+    on_stop_typing=on_stop_typing,
+    search_index=SearchIndex.load(SEARCH_INDEX_PATH),
+)
+# a fixed client id and a persistent session, so that the broker keeps
+# our subscriptions and queues messages while we are offline
+MQTTC = mqtt.Client(client_id=f"ttm4175-chat-{MY_ID}", clean_session=False)
+TRANSPORT = AsyncMqttTransport(MQTTC) if ASYNC_MODE else None
+DELIVERED_RECEIPTS = ReceiptBatcher("delivered")
+# direct messages are sent until delivered; broadcasts only once
+OUTBOX = Outbox(lambda topic, payload: publish(topic, payload, 1), OUTBOX_PATH)
+SEEN_UUIDS = SeenUuids()
+CONNECTION = ConnectionManager(
+    MQTTC,
+    [
+        (f"ttm4175/chat/{MY_ID}/+", 1),
+        (BROADCAST_TOPIC, 1),
+        ("ttm4175/chat/+/presence", 1),
+    ],
+    on_connect,
+)
+ROUTER = TopicRouter()
+ROUTER.register("message", handle_message, ("message", "uuid"))
+ROUTER.register("delivered", handle_delivered, ("uuid",))
+ROUTER.register("read", handle_read, ("uuid",))
+ROUTER.register("typing", handle_typing)
+ROUTER.register("typing_stopped", handle_typing_stopped)
+ROUTER.register("presence", handle_presence)
 
 
-def main() -> None:
+def connect(host: str = BROKER_HOST, port: int = BROKER_PORT) -> None:
     MQTTC.on_message = on_message
-    MQTTC.on_connect = on_connect
-    MQTTC.connect("mqtt20.iik.ntnu.no", 1883)
-    MQTTC.loop_start()
-    MQTTC.subscribe(f"ttm4175/chat/{MY_ID}/+")
+    MQTTC.will_set(
+        PRESENCE_TOPIC, presence_payload(PRESENCE_OFFLINE), 1, retain=True
+    )
+    if TRANSPORT is not None:
+        # connects once; subscribing still happens in on_connect
+        CONNECTION.connecting()
+        TRANSPORT.start()
+        TRANSPORT.run(TRANSPORT.connect(host, port)).result()
+    else:
+        CONNECTION.start(host, port)
+    OUTBOX.start()
 
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="MQTT chat client")
+    parser.add_argument("--host", default=BROKER_HOST)
+    parser.add_argument("--port", type=int, default=BROKER_PORT)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    connect(args.host, args.port)
     GUI.show()
+    GUI.data.search_index.save(SEARCH_INDEX_PATH)
 
 
 if __name__ == "__main__":
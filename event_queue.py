@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import heapq
+import logging
+import threading
+from collections import deque
+from operator import itemgetter
+from typing import NamedTuple
+
+EVENT_MESSAGE = "message"
+EVENT_TYPING = "typing"
+EVENT_TYPING_STOPPED = "typing_stopped"
+EVENT_READ = "read"
+EVENT_DELIVERED = "delivered"
+EVENT_PRESENCE = "presence"
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ChatEvent(NamedTuple):
+    kind: str
+    sender: str
+    message: str = ""
+    message_uuid: str = ""
+
+
+class QueueStats(NamedTuple):
+    depth: int
+    high_water: int
+    put: int
+    drained: int
+    coalesced: int
+    dropped_typing: int
+    overflowed: int
+
+
+class EventQueue:
+    """Handoff from the MQTT network thread to the GUI thread.
+
+    put() never blocks, so the network thread keeps up with keepalives
+    and acknowledgements however far the GUI falls behind. Typing and
+    stopped-typing events from the same sender are coalesced into the
+    latest one, and they are the only events ever dropped: when the queue
+    holds maxsize events, new typing events are dropped, and queued ones
+    make room for other events. Other events are queued beyond maxsize
+    rather than lost, which is counted in overflowed and logged. drain()
+    returns events in arrival order, a coalesced typing event where its
+    latest one arrived.
+    """
+
+    def __init__(self, maxsize: int = 10_000) -> None:
+        self.maxsize = maxsize
+        # events and the latest typing event per sender, each with its
+        # arrival number, so that drain() can keep them in order
+        self._events: deque[tuple[int, ChatEvent]] = deque()
+        self._typing: dict[str, tuple[int, ChatEvent]] = {}
+        self._lock = threading.Lock()
+        self._overflowing = False
+        self._high_water = 0
+        self._put = 0
+        self._drained = 0
+        self._coalesced = 0
+        self._dropped_typing = 0
+        self._overflowed = 0
+
+    def __len__(self) -> int:
+        return len(self._events) + len(self._typing)
+
+    def put(self, event: ChatEvent) -> bool:
+        """Queues the event without blocking. Returns False if it is a
+        typing event that was dropped."""
+        with self._lock:
+            self._put += 1
+            if event.kind in (EVENT_TYPING, EVENT_TYPING_STOPPED):
+                if event.sender in self._typing:
+                    self._typing[event.sender] = (self._put, event)
+                    self._coalesced += 1
+                    return True
+                if len(self) >= self.maxsize:
+                    self._dropped_typing += 1
+                    return False
+                self._typing[event.sender] = (self._put, event)
+            else:
+                if len(self) >= self.maxsize and self._typing:
+                    self._typing.popitem()
+                    self._dropped_typing += 1
+                if len(self) >= self.maxsize:
+                    self._overflowed += 1
+                    if not self._overflowing:
+                        self._overflowing = True
+                        LOGGER.warning(
+                            "Event queue holds more than %d events, the GUI "
+                            "falls behind the network",
+                            self.maxsize,
+                        )
+                self._events.append((self._put, event))
+            self._high_water = max(self._high_water, len(self))
+            return True
+
+    def drain(self, limit: int | None = None) -> list[ChatEvent]:
+        """Takes up to limit events, plus the typing events that arrived
+        before the first event left in the queue, in arrival order."""
+        with self._lock:
+            count = len(self._events)
+            if limit is not None:
+                count = min(count, max(0, limit))
+            events = [self._events.popleft() for _ in range(count)]
+            # typing events after the first remaining event wait for it
+            cutoff = self._events[0][0] if self._events else self._put + 1
+            typing = sorted(
+                arrival
+                for arrival in self._typing.values()
+                if arrival[0] < cutoff
+            )
+            for _, event in typing:
+                del self._typing[event.sender]
+            batch = [
+                event
+                for _, event in heapq.merge(events, typing, key=itemgetter(0))
+            ]
+            self._drained += len(batch)
+            if len(self) < self.maxsize:
+                self._overflowing = False
+            return batch
+
+    def stats(self) -> QueueStats:
+        with self._lock:
+            return QueueStats(
+                depth=len(self),
+                high_water=self._high_water,
+                put=self._put,
+                drained=self._drained,
+                coalesced=self._coalesced,
+                dropped_typing=self._dropped_typing,
+                overflowed=self._overflowed,
+            )
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import codecs
+import json
+import re
+from collections.abc import Iterable
+from typing import Any
+
+
+# Longest single value, in characters; an incomplete value is parsed again
+# with every chunk read, so this bounds the work per value
+MAX_VALUE_CHARS = 64 * 1024
+
+JSON_DECODER = json.JSONDecoder()
+NON_WHITESPACE = re.compile(r"\S")
+NUMBER_CHARS = frozenset("0123456789+-.eE")
+
+
+class JsonReader:
+    """Parses JSON values out of chunks of UTF-8 bytes as they arrive.
+
+    Only the unparsed rest of the chunks is kept in buffer, from pos on,
+    and no more chunks are read than needed for the values taken. The
+    caller walks the structure around the values with next_char(),
+    search() and match(). Raises ValueError for invalid UTF-8 or JSON, and
+    for a value longer than max_value_chars.
+    """
+
+    def __init__(
+        self, chunks: Iterable[bytes], max_value_chars: int = MAX_VALUE_CHARS
+    ) -> None:
+        self.chunks = iter(chunks)
+        self.max_value_chars = max_value_chars
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+
+    def fill(self) -> bool:
+        """Appends the next chunk to the buffer, False at the end."""
+        try:
+            for chunk in self.chunks:
+                text = self.decoder.decode(chunk)
+                break
+            else:
+                self.decoder.decode(b"", final=True)
+                return False
+        except UnicodeDecodeError as e:
+            raise ValueError(str(e)) from None
+        self.buffer = self.buffer[self.pos :] + text
+        self.pos = 0
+        return True
+
+    def next_char(self) -> str | None:
+        """Skips whitespace, returns the next character or None at the end."""
+        while (match := NON_WHITESPACE.search(self.buffer, self.pos)) is None:
+            self.pos = len(self.buffer)
+            if not self.fill():
+                return None
+        self.pos = pos = match.start()
+        return self.buffer[pos]
+
+    def search(self, pattern: re.Pattern, overlap: int) -> re.Match | None:
+        """Moves past the next match of pattern, which is at most overlap
+        characters long, or returns None when there is none."""
+        while (match := pattern.search(self.buffer, self.pos)) is None:
+            self.pos = max(len(self.buffer) - overlap, self.pos)
+            if not self.fill():
+                return None
+        self.pos = match.end()
+        return match
+
+    def match(self, pattern: re.Pattern) -> re.Match | None:
+        """Moves past pattern if it matches at pos, without reading."""
+        if match := pattern.match(self.buffer, self.pos):
+            self.pos = match.end()
+        return match
+
+    def _refill(self) -> bool:
+        """Reads more of a value that may continue in the next chunk."""
+        if len(self.buffer) - self.pos > self.max_value_chars:
+            raise ValueError(
+                f"value longer than {self.max_value_chars} characters"
+            )
+        return self.fill()
+
+    def value(self) -> Any:
+        """Parses the value at pos, see next_char()."""
+        while True:
+            buffer = self.buffer
+            try:
+                value, end = JSON_DECODER.raw_decode(buffer, self.pos)
+            except json.JSONDecodeError as e:
+                if self._refill():
+                    continue  # the value may continue in the next chunk
+                raise ValueError(e.msg) from None
+            if (
+                end == len(buffer) or buffer[end] in NUMBER_CHARS
+            ) and self._refill():
+                continue  # a number may continue in the next chunk
+            self.pos = end
+            return value
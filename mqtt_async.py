@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import socket
+import threading
+from typing import Any
+
+import paho.mqtt.client as mqtt
+
+
+MAX_INFLIGHT = 20
+MISC_LOOP_SECONDS = 1.0
+# A publish that is not acknowledged in time gives up its inflight slot
+ACK_TIMEOUT_SECONDS = 30.0
+
+
+class AsyncMqttTransport:
+    """Drives a paho client from an asyncio event loop in its own thread.
+
+    The client's socket is registered with the event loop through paho's
+    external loop hooks (on_socket_open/close, on_socket_(un)register_write)
+    instead of running loop_start()'s select loop. Publishes are pipelined:
+    up to max_inflight QoS 1 publishes are on the wire at once, and each
+    one's future resolves when the broker's PUBACK arrives.
+    """
+
+    def __init__(
+        self, client: mqtt.Client, max_inflight: int = MAX_INFLIGHT
+    ) -> None:
+        self.client = client
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="mqtt-asyncio", daemon=True
+        )
+        self.inflight = asyncio.Semaphore(max_inflight)
+        self.acks: dict[int, asyncio.Future[None]] = {}
+        self.misc_task: asyncio.Task[None] | None = None
+        client.max_inflight_messages_set(max_inflight)
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+        client.on_publish = self._on_publish
+
+    def _on_socket_open(
+        self, client: mqtt.Client, userdata: Any, sock: socket.socket
+    ) -> None:
+        self.loop.add_reader(sock, client.loop_read)
+
+    def _on_socket_close(
+        self, client: mqtt.Client, userdata: Any, sock: socket.socket
+    ) -> None:
+        self.loop.remove_reader(sock)
+
+    def _on_socket_register_write(
+        self, client: mqtt.Client, userdata: Any, sock: socket.socket
+    ) -> None:
+        self.loop.add_writer(sock, client.loop_write)
+
+    def _on_socket_unregister_write(
+        self, client: mqtt.Client, userdata: Any, sock: socket.socket
+    ) -> None:
+        self.loop.remove_writer(sock)
+
+    def _on_publish(
+        self, client: mqtt.Client, userdata: Any, mid: int
+    ) -> None:
+        # QoS 0 publishes and abandoned waits have no future
+        future = self.acks.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    async def _misc_loop(self) -> None:
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(MISC_LOOP_SECONDS)
+
+    async def connect(self, host: str, port: int = 1883) -> None:
+        self.client.connect(host, port)
+        if self.misc_task is None or self.misc_task.done():
+            self.misc_task = self.loop.create_task(self._misc_loop())
+
+    async def subscribe(self, topic: str, qos: int = 0) -> None:
+        self.client.subscribe(topic, qos)
+
+    async def publish(
+        self,
+        topic: str,
+        payload: bytes | str,
+        qos: int = 1,
+        retain: bool = False,
+    ) -> None:
+        """Publishes and waits for the broker's acknowledgement (QoS > 0).
+
+        At most max_inflight publishes wait for an acknowledgement at once;
+        further publishes wait for a free slot before being sent. Raises
+        TimeoutError when there is no acknowledgement within
+        ACK_TIMEOUT_SECONDS.
+        """
+        if qos == 0:
+            self.client.publish(topic, payload, qos, retain)
+            return
+        async with self.inflight:
+            info = self.client.publish(topic, payload, qos, retain)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                raise ConnectionError(mqtt.error_string(info.rc))
+            if info.is_published():
+                return
+            future = self.loop.create_future()
+            self.acks[info.mid] = future
+            try:
+                await asyncio.wait_for(future, ACK_TIMEOUT_SECONDS)
+            finally:
+                if self.acks.get(info.mid) is future:
+                    del self.acks[info.mid]
+
+    def congested(self) -> bool:
+        """True while every inflight slot waits for an acknowledgement."""
+        return self.inflight.locked()
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def run(self, coroutine: Any) -> concurrent.futures.Future:
+        """Schedules a coroutine from any thread without waiting for it."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def publish_threadsafe(
+        self,
+        topic: str,
+        payload: bytes | str,
+        qos: int = 1,
+        retain: bool = False,
+    ) -> concurrent.futures.Future:
+        return self.run(self.publish(topic, payload, qos, retain))
+
+    def stop(self) -> None:
+        self.loop.call_soon_threadsafe(self.client.disconnect)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
@@ -0,0 +1,325 @@
+from __future__ import annotations
+
+import asyncio
+import struct
+import sys
+import threading
+from dataclasses import dataclass, field
+
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+# Messages queued for an offline persistent session before old ones drop
+SESSION_QUEUE_LIMIT = 10_000
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for index, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if index >= len(topic_levels):
+            return False
+        if level not in ("+", topic_levels[index]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def encode_length(length: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded)
+
+
+def encode_string(string: str) -> bytes:
+    data = string.encode()
+    return struct.pack("!H", len(data)) + data
+
+
+def packet(kind: int, flags: int, body: bytes) -> bytes:
+    return bytes([kind << 4 | flags]) + encode_length(len(body)) + body
+
+
+@dataclass
+class Session:
+    client_id: str
+    persistent: bool
+    subscriptions: dict[str, int] = field(default_factory=dict)
+    queue: list[tuple[str, bytes, int]] = field(default_factory=list)
+    writer: asyncio.StreamWriter | None = None
+    next_mid: int = 0
+
+    def mid(self) -> int:
+        self.next_mid = self.next_mid % 65535 + 1
+        return self.next_mid
+
+
+class MqttBroker:
+    """Minimal in-process MQTT 3.1.1 broker for local testing.
+
+    Supports QoS 0 and 1 (QoS 2 publishes are acknowledged and delivered
+    as QoS 1), + and # wildcards, retained messages, last wills and
+    persistent sessions (clean_session=False) that queue QoS 1 messages
+    while the client is offline. There is no authentication and no
+    retransmission of unacknowledged messages.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.host = host
+        self.port = port
+        self.sessions: dict[str, Session] = {}
+        self.retained: dict[str, tuple[bytes, int]] = {}
+        self.published = 0
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.server: asyncio.Server | None = None
+        self.thread: threading.Thread | None = None
+
+    async def serve(self) -> None:
+        self.server = await asyncio.start_server(
+            self._handle_client, self.host, self.port
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self) -> None:
+        await self.serve()
+        if self.server is not None:
+            await self.server.serve_forever()
+
+    def start(self) -> MqttBroker:
+        """Runs the broker on an event loop in a background thread."""
+        started = threading.Event()
+
+        def run() -> None:
+            self.loop = asyncio.new_event_loop()
+            self.loop.run_until_complete(self.serve())
+            started.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(
+            target=run, name="mqtt-broker", daemon=True
+        )
+        self.thread.start()
+        started.wait()
+        return self
+
+    async def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+        clients = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in clients:
+            task.cancel()
+        await asyncio.gather(*clients, return_exceptions=True)
+
+    def stop(self) -> None:
+        if self.loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread is not None:
+            self.thread.join()
+
+    async def _read_packet(
+        self, reader: asyncio.StreamReader
+    ) -> tuple[int, int, bytes]:
+        header = (await reader.readexactly(1))[0]
+        length = 0
+        multiplier = 1
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        return header >> 4, header & 0x0F, await reader.readexactly(length)
+
+    def _send(
+        self,
+        session: Session,
+        topic: str,
+        payload: bytes,
+        qos: int,
+        retain: bool = False,
+    ) -> None:
+        if session.writer is None:
+            if session.persistent and qos:
+                session.queue.append((topic, payload, qos))
+                del session.queue[:-SESSION_QUEUE_LIMIT]
+            return
+        body = encode_string(topic)
+        if qos:
+            body += struct.pack("!H", session.mid())
+        session.writer.write(
+            packet(PUBLISH, qos << 1 | retain, body + payload)
+        )
+
+    def publish(
+        self, topic: str, payload: bytes, qos: int = 0, retain: bool = False
+    ) -> None:
+        self.published += 1
+        if retain:
+            if payload:
+                self.retained[topic] = (payload, qos)
+            else:
+                self.retained.pop(topic, None)
+        for session in self.sessions.values():
+            granted = [
+                sub_qos
+                for topic_filter, sub_qos in session.subscriptions.items()
+                if topic_matches(topic_filter, topic)
+            ]
+            if granted:
+                self._send(session, topic, payload, min(qos, max(granted)))
+
+    def _connect(
+        self, body: bytes, writer: asyncio.StreamWriter
+    ) -> tuple[Session, tuple[str, bytes, int, bool] | None]:
+        name_length = struct.unpack_from("!H", body)[0]
+        offset = 2 + name_length + 1
+        flags = body[offset]
+        offset += 3
+        strings: list[bytes] = []
+        while offset < len(body):
+            length = struct.unpack_from("!H", body, offset)[0]
+            strings.append(body[offset + 2 : offset + 2 + length])
+            offset += 2 + length
+        client_id = strings[0].decode() or f"anonymous-{id(writer)}"
+        will = None
+        if flags & 0x04:
+            will = (
+                strings[1].decode(),
+                strings[2],
+                (flags >> 3) & 0x03,
+                bool(flags & 0x20),
+            )
+        clean = bool(flags & 0x02)
+        previous = self.sessions.get(client_id)
+        if previous is not None and previous.writer is not None:
+            previous.writer.close()
+        present = previous is not None and not clean and previous.persistent
+        if present:
+            session = previous
+        else:
+            session = Session(client_id, persistent=not clean)
+        session.writer = writer
+        self.sessions[client_id] = session
+        writer.write(packet(CONNACK, 0, bytes([present, 0])))
+        queued, session.queue = session.queue, []
+        for topic, payload, qos in queued:
+            self._send(session, topic, payload, qos)
+        return session, will
+
+    def _subscribe(self, session: Session, body: bytes) -> None:
+        mid = body[:2]
+        offset = 2
+        granted = bytearray()
+        while offset < len(body):
+            length = struct.unpack_from("!H", body, offset)[0]
+            topic_filter = body[offset + 2 : offset + 2 + length].decode()
+            qos = min(body[offset + 2 + length], 1)
+            offset += 3 + length
+            session.subscriptions[topic_filter] = qos
+            granted.append(qos)
+            for topic, (payload, retained_qos) in self.retained.items():
+                if topic_matches(topic_filter, topic):
+                    self._send(
+                        session, topic, payload, min(qos, retained_qos), True
+                    )
+        session.writer.write(packet(SUBACK, 0, mid + bytes(granted)))
+
+    def _unsubscribe(self, session: Session, body: bytes) -> None:
+        offset = 2
+        while offset < len(body):
+            length = struct.unpack_from("!H", body, offset)[0]
+            topic_filter = body[offset + 2 : offset + 2 + length].decode()
+            session.subscriptions.pop(topic_filter, None)
+            offset += 2 + length
+        session.writer.write(packet(UNSUBACK, 0, body[:2]))
+
+    def _publish(self, session: Session, flags: int, body: bytes) -> None:
+        qos = (flags >> 1) & 0x03
+        length = struct.unpack_from("!H", body)[0]
+        topic = body[2 : 2 + length].decode()
+        offset = 2 + length
+        if qos:
+            mid = body[offset : offset + 2]
+            offset += 2
+            reply = PUBACK if qos == 1 else PUBREC
+            session.writer.write(packet(reply, 0, mid))
+        self.publish(topic, body[offset:], min(qos, 1), bool(flags & 0x01))
+
+    async def _handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        session: Session | None = None
+        will = None
+        try:
+            kind, flags, body = await self._read_packet(reader)
+            if kind != CONNECT:
+                return
+            session, will = self._connect(body, writer)
+            while True:
+                kind, flags, body = await self._read_packet(reader)
+                if kind == PUBLISH:
+                    self._publish(session, flags, body)
+                elif kind == PUBREL:
+                    writer.write(packet(PUBCOMP, 0, body[:2]))
+                elif kind == SUBSCRIBE:
+                    self._subscribe(session, body)
+                elif kind == UNSUBSCRIBE:
+                    self._unsubscribe(session, body)
+                elif kind == PINGREQ:
+                    writer.write(packet(PINGRESP, 0, b""))
+                elif kind == DISCONNECT:
+                    will = None
+                    break
+                await writer.drain()
+        except (
+            asyncio.CancelledError,
+            asyncio.IncompleteReadError,
+            ConnectionError,
+        ):
+            pass
+        finally:
+            if session is not None and session.writer is writer:
+                session.writer = None
+                # a reconnect with a clean session replaces this one
+                client_id = session.client_id
+                if (
+                    not session.persistent
+                    and self.sessions.get(client_id) is session
+                ):
+                    del self.sessions[client_id]
+            if will is not None:
+                self.publish(*will)
+            writer.close()
+
+
+def main() -> None:
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 1883
+    broker = MqttBroker("0.0.0.0", port)
+    print(f"MQTT broker listening on port {port}, terminate with Ctrl-C.")
+    try:
+        asyncio.run(broker.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
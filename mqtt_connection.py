@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Sequence
+from typing import Any, NamedTuple
+
+import paho.mqtt.client as mqtt
+
+
+RECONNECT_MIN_SECONDS = 1.0
+RECONNECT_MAX_SECONDS = 60.0
+KEEPALIVE_SECONDS = 60
+LOOP_SECONDS = 1.0
+
+# Publishes kept while offline; the oldest are dropped beyond this
+OFFLINE_BUFFER_SIZE = 10_000
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ConnectionStats(NamedTuple):
+    connected: bool
+    connects: int
+    last_connect_seconds: float | None
+    outages: int
+    last_outage_seconds: float | None
+    longest_outage_seconds: float
+    buffered: int
+    flushed: int
+    dropped: int
+
+
+class ConnectionManager:
+    """Keeps a paho client connected, driving it from its own thread.
+
+    The client should have a fixed client id and clean_session=False, so
+    that the broker keeps our subscriptions and queues QoS 1 messages for
+    us while we are away. Subscriptions are (re)made in on_connect, after
+    which the publishes buffered during the outage are sent in one go.
+    Failed connections are retried with exponential backoff and jitter.
+
+    An exception in one of the client's callbacks is logged instead of
+    ending the connection, so that a malformed message cannot stop us from
+    receiving the ones after it.
+    """
+
+    def __init__(
+        self,
+        client: mqtt.Client,
+        subscriptions: Sequence[tuple[str, int]],
+        on_connect: Callable[..., None] | None = None,
+    ) -> None:
+        self.client = client
+        self.subscriptions = list(subscriptions)
+        self.on_connect = on_connect
+        self.host = ""
+        self.port = 0
+        self.connected = False
+        self.lock = threading.Lock()
+        # (topic, payload) -> (qos, retain), so retries of the same
+        # publish are buffered once
+        self.buffer: OrderedDict[tuple[str, bytes], tuple[int, bool]] = (
+            OrderedDict()
+        )
+        self.stopped = threading.Event()
+        self.thread: threading.Thread | None = None
+        self.attempts = 0
+        self.connect_started = 0.0
+        self.outage_started: float | None = None
+        self.connects = 0
+        self.last_connect_seconds: float | None = None
+        self.outages = 0
+        self.last_outage_seconds: float | None = None
+        self.longest_outage_seconds = 0.0
+        self.flushed = 0
+        self.dropped = 0
+        client.on_connect = self.handle_connect
+        # paho raises callback exceptions out of loop() otherwise, before
+        # acknowledging the message and with the packet half processed
+        client.suppress_exceptions = True
+        if client.logger is None:
+            client.enable_logger(LOGGER)
+
+    def handle_connect(
+        self, client: mqtt.Client, userdata: Any, flags: Any, rc: Any
+    ) -> None:
+        if rc != 0:
+            LOGGER.warning("Connection refused: %s", rc)
+            return
+        now = time.monotonic()
+        self.attempts = 0
+        self.connects += 1
+        self.last_connect_seconds = now - self.connect_started
+        if self.outage_started is not None:
+            self.last_outage_seconds = now - self.outage_started
+            self.longest_outage_seconds = max(
+                self.longest_outage_seconds, self.last_outage_seconds
+            )
+            self.outage_started = None
+        if self.subscriptions:
+            client.subscribe(self.subscriptions)
+        with self.lock:
+            self.connected = True
+            buffered, self.buffer = self.buffer, OrderedDict()
+            for (topic, payload), (qos, retain) in buffered.items():
+                client.publish(topic, payload, qos, retain)
+            self.flushed += len(buffered)
+        if buffered:
+            LOGGER.info("Sent %d messages from the outage", len(buffered))
+        if self.on_connect is not None:
+            self.on_connect(client, userdata, flags, rc)
+
+    def _disconnected(self) -> None:
+        with self.lock:
+            if not self.connected:
+                return
+            self.connected = False
+        if self.stopped.is_set():
+            return
+        self.outages += 1
+        self.outage_started = time.monotonic()
+        LOGGER.warning("Disconnected from %s:%d", self.host, self.port)
+
+    def publish(
+        self, topic: str, payload: bytes, qos: int = 0, retain: bool = False
+    ) -> None:
+        """Publishes now, or when connected again."""
+        with self.lock:
+            if self.connected:
+                self.client.publish(topic, payload, qos, retain)
+                return
+            self.buffer[(topic, payload)] = (qos, retain)
+            if len(self.buffer) > OFFLINE_BUFFER_SIZE:
+                self.buffer.popitem(last=False)
+                self.dropped += 1
+
+    def backoff(self) -> float:
+        delay = min(
+            RECONNECT_MIN_SECONDS * 2 ** (self.attempts - 1),
+            RECONNECT_MAX_SECONDS,
+        )
+        return random.uniform(delay / 2, delay)
+
+    def _run(self) -> None:
+        while not self.stopped.is_set():
+            self.connect_started = time.monotonic()
+            try:
+                self.client.connect(self.host, self.port, KEEPALIVE_SECONDS)
+            except OSError as e:
+                LOGGER.warning(
+                    "Connecting to %s:%d failed: %s", self.host, self.port, e
+                )
+            else:
+                try:
+                    while (
+                        not self.stopped.is_set()
+                        and self.client.loop(LOOP_SECONDS)
+                        == mqtt.MQTT_ERR_SUCCESS
+                    ):
+                        pass
+                except Exception:
+                    # the client's state is unknown, connect() resets it
+                    LOGGER.exception(
+                        "Connection to %s:%d failed", self.host, self.port
+                    )
+                self._disconnected()
+            self.attempts += 1
+            self.stopped.wait(self.backoff())
+
+    def start(self, host: str, port: int = 1883) -> None:
+        self.host = host
+        self.port = port
+        self.thread = threading.Thread(
+            target=self._run, name="mqtt-connection", daemon=True
+        )
+        self.thread.start()
+
+    def connecting(self) -> None:
+        """Marks the start of a connection attempt made by someone else,
+        for example an AsyncMqttTransport, for the connect latency."""
+        self.connect_started = time.monotonic()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.client.disconnect()
+        if self.thread is not None:
+            self.thread.join()
+
+    def stats(self) -> ConnectionStats:
+        with self.lock:
+            return ConnectionStats(
+                connected=self.connected,
+                connects=self.connects,
+                last_connect_seconds=self.last_connect_seconds,
+                outages=self.outages,
+                last_outage_seconds=self.last_outage_seconds,
+                longest_outage_seconds=self.longest_outage_seconds,
+                buffered=len(self.buffer),
+                flushed=self.flushed,
+                dropped=self.dropped,
+            )
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import heapq
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+
+
+RETRY_BASE_SECONDS = 2.0
+RETRY_MAX_SECONDS = 300.0
+RETRY_JITTER = 0.1
+
+# Message uuids remembered on the receiving side for deduplication
+SEEN_UUIDS = 100_000
+
+
+class Outbox:
+    """Messages that were sent but not confirmed by a delivered receipt.
+
+    Each message is published again after RETRY_BASE_SECONDS, doubling up
+    to RETRY_MAX_SECONDS with some jitter, until acknowledge() is called
+    with its uuid. With a path, the outbox is kept in an SQLite table so
+    that unconfirmed messages are sent again after a restart. Use its own
+    database file: an SqliteStore holds its write lock between group
+    commits.
+    """
+
+    def __init__(
+        self,
+        publish: Callable[[str, bytes], None],
+        path: str | None = None,
+    ) -> None:
+        self.publish = publish
+        # uuid -> (topic, payload, attempts)
+        self.pending: dict[str, tuple[str, bytes, int]] = {}
+        # (due, uuid, attempts), entries of older attempts are skipped
+        self.schedule: list[tuple[float, str, int]] = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.thread: threading.Thread | None = None
+        self.stopped = False
+        self.retransmitted = 0
+        self.connection: sqlite3.Connection | None = None
+        if path is not None:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.executescript("""
+                PRAGMA journal_mode = WAL;
+                PRAGMA synchronous = NORMAL;
+                CREATE TABLE IF NOT EXISTS outbox (
+                    uuid TEXT PRIMARY KEY,
+                    topic TEXT NOT NULL,
+                    payload BLOB NOT NULL
+                );
+                """)
+            for message_uuid, topic, payload in self.connection.execute(
+                "SELECT uuid, topic, payload FROM outbox ORDER BY rowid"
+            ):
+                # sent before the restart, so the first retry is due now
+                self.pending[message_uuid] = (topic, payload, 1)
+                self.schedule.append((0.0, message_uuid, 1))
+            # ties on due are ordered by uuid, not by rowid
+            heapq.heapify(self.schedule)
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    @staticmethod
+    def backoff(attempts: int) -> float:
+        delay = min(
+            RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS
+        )
+        return delay * random.uniform(1 - RETRY_JITTER, 1 + RETRY_JITTER)
+
+    def send(self, message_uuid: str, topic: str, payload: bytes) -> None:
+        """Stores the message, publishes it and schedules its retry."""
+        with self.lock:
+            if self.connection is not None:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO outbox (uuid, topic, payload)"
+                    " VALUES (?, ?, ?)",
+                    (message_uuid, topic, payload),
+                )
+                self.connection.commit()
+            self.pending[message_uuid] = (topic, payload, 1)
+            due = time.monotonic() + self.backoff(1)
+            heapq.heappush(self.schedule, (due, message_uuid, 1))
+            if self.schedule[0][1] == message_uuid:
+                self.wakeup.notify()
+        self.publish(topic, payload)
+
+    def acknowledge(self, message_uuid: str) -> bool:
+        with self.lock:
+            if self.pending.pop(message_uuid, None) is None:
+                return False
+            if self.connection is not None:
+                self.connection.execute(
+                    "DELETE FROM outbox WHERE uuid = ?", (message_uuid,)
+                )
+                self.connection.commit()
+            return True
+
+    def _due(self) -> list[tuple[str, bytes]]:
+        """Waits for the next due retry, then takes all that are due."""
+        with self.lock:
+            while not self.stopped:
+                now = time.monotonic()
+                if self.schedule and self.schedule[0][0] <= now:
+                    break
+                timeout = self.schedule[0][0] - now if self.schedule else None
+                self.wakeup.wait(timeout)
+            now = time.monotonic()
+            due: list[tuple[str, bytes]] = []
+            while self.schedule and self.schedule[0][0] <= now:
+                _, message_uuid, attempts = heapq.heappop(self.schedule)
+                entry = self.pending.get(message_uuid)
+                if entry is None or entry[2] != attempts:
+                    continue  # acknowledged, or sent again since
+                topic, payload, _ = entry
+                attempts += 1
+                self.pending[message_uuid] = (topic, payload, attempts)
+                heapq.heappush(
+                    self.schedule,
+                    (now + self.backoff(attempts), message_uuid, attempts),
+                )
+                due.append((topic, payload))
+            return due
+
+    def _run(self) -> None:
+        while not self.stopped:
+            for topic, payload in self._due():
+                self.retransmitted += 1
+                self.publish(topic, payload)
+
+    def start(self) -> None:
+        self.thread = threading.Thread(
+            target=self._run, name="outbox", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self) -> None:
+        with self.lock:
+            self.stopped = True
+            self.wakeup.notify()
+        if self.thread is not None:
+            self.thread.join()
+        if self.connection is not None:
+            self.connection.close()
+
+
+class SeenUuids:
+    """Bounded LRU set of message uuids, to drop redelivered messages
+    before they reach the event queue."""
+
+    def __init__(self, maxsize: int = SEEN_UUIDS) -> None:
+        self.maxsize = maxsize
+        self.uuids: OrderedDict[str, None] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, message_uuid: str) -> bool:
+        """Returns False if the uuid was seen before."""
+        with self.lock:
+            if message_uuid in self.uuids:
+                self.uuids.move_to_end(message_uuid)
+                return False
+            self.uuids[message_uuid] = None
+            if len(self.uuids) > self.maxsize:
+                self.uuids.popitem(last=False)
+            return True
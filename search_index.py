@@ -0,0 +1,289 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import sys
+from array import array
+from bisect import bisect_left, insort
+from typing import NamedTuple
+
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Query words shorter than this only match whole tokens, so that a single
+# letter does not expand to most of the vocabulary
+MIN_PREFIX_LENGTH = 2
+
+SEARCH_LIMIT = 50
+
+# Documents searched at once, newest first; the window doubles while the
+# search goes back in time
+SEARCH_WINDOW = 4_096
+
+SNAPSHOT_VERSION = 3
+# Message.key of a packed uuid, see chat_session.pack_uuid
+PACKED_KEY_BYTES = 16
+
+
+class SearchHit(NamedTuple):
+    contact: str
+    key: bytes | str  # Message.key
+
+
+def tokenize(text: str) -> list[str]:
+    """The distinct lowercase words of text, in order of appearance."""
+    return list(dict.fromkeys(TOKEN_PATTERN.findall(text.lower())))
+
+
+def _contains(term: list[array], doc: int) -> bool:
+    for postings in term:
+        i = bisect_left(postings, doc)
+        if i < len(postings) and postings[i] == doc:
+            return True
+    return False
+
+
+def _members(term: list[array], low: int, high: int) -> set[int]:
+    """The documents in [low, high) of any of the posting lists of term."""
+    return set().union(
+        *(
+            postings[bisect_left(postings, low) : bisect_left(postings, high)]
+            for postings in term
+        )
+    )
+
+
+class SearchIndex:
+    """Incremental inverted index over the messages of all histories.
+
+    Every message added gets the next document number, and each token maps
+    to the ascending array of documents containing it, so the newest
+    matches are at the end of every posting list. A query matches messages
+    that contain, for every query word, a token starting with that word;
+    the results are found newest first by intersecting the posting lists
+    in windows of documents going back in time, which stops at the limit,
+    so a query does not touch older matches.
+
+    The index can be saved next to the SqliteStore and loaded again;
+    last_seq tells which stored messages are newer than the snapshot. A
+    snapshot is a line of JSON, with the contacts, tokens and the keys
+    that are not packed uuids, followed by the raw bytes of the packed
+    keys and of the arrays.
+    """
+
+    def __init__(self) -> None:
+        # per document: the Message.key and the number of its contact
+        self.keys: list[bytes | str] = []
+        self.doc_contacts = array("I")
+        # the other recipients of broadcasts, by document
+        self.broadcast_contacts: dict[int, list[int]] = {}
+        self.contacts: list[str] = []
+        self.contact_ids: dict[str, int] = {}
+        self.postings: dict[str, array] = {}
+        self.tokens: list[str] = []  # sorted, for prefix lookups
+        self.last_seq = 0  # newest store seq indexed
+        self.path: str | None = None  # where load() found the snapshot
+        self.saved_length = 0  # documents in the last snapshot
+
+    @property
+    def unsaved(self) -> int:
+        """Documents added since the last snapshot."""
+        return len(self.keys) - self.saved_length
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(
+        self,
+        contact: str,
+        key: bytes | str,
+        text: str,
+        seq: int | None = None,
+    ) -> bool:
+        """Indexes a message. A broadcast is added to every history in
+        turn, but only indexed once, under all of its contacts."""
+        if seq is not None and seq > self.last_seq:
+            self.last_seq = seq
+        if (contact_id := self.contact_ids.get(contact)) is None:
+            contact_id = self.contact_ids[contact] = len(self.contacts)
+            self.contacts.append(contact)
+        doc = len(self.keys)
+        if self.keys and self.keys[-1] == key:
+            others = self.broadcast_contacts.setdefault(doc - 1, [])
+            if (
+                contact_id != self.doc_contacts[-1]
+                and contact_id not in others
+            ):
+                others.append(contact_id)
+            return False
+        self.keys.append(key)
+        self.doc_contacts.append(contact_id)
+        for token in tokenize(text):
+            if (postings := self.postings.get(token)) is None:
+                postings = self.postings[token] = array("I")
+                insort(self.tokens, token)
+            postings.append(doc)
+        return True
+
+    def _expand(self, word: str) -> list[array]:
+        if len(word) < MIN_PREFIX_LENGTH:
+            postings = self.postings.get(word)
+            return [postings] if postings is not None else []
+        expanded = []
+        for i in range(bisect_left(self.tokens, word), len(self.tokens)):
+            if not self.tokens[i].startswith(word):
+                break
+            expanded.append(self.postings[self.tokens[i]])
+        return expanded
+
+    def search(
+        self, query: str, contact: str | None = None, limit: int = SEARCH_LIMIT
+    ) -> list[SearchHit]:
+        """The newest messages matching every word of query as a prefix,
+        optionally only those of one contact."""
+        words = tokenize(query)
+        if not words:
+            return []
+        terms = [self._expand(word) for word in words]
+        if not all(terms):
+            return []
+        contact_id = None
+        if contact is not None:
+            if (contact_id := self.contact_ids.get(contact)) is None:
+                return []
+        # Intersect window by window, newest first, starting from the term
+        # with the fewest postings. The others are intersected as sets too,
+        # unless they have many more postings, then a bisect per candidate
+        # is cheaper.
+        terms.sort(key=lambda postings: sum(map(len, postings)))
+        candidates = sum(map(len, terms[0]))
+        windowed = [
+            sum(map(len, term)) <= 4 * candidates * len(term)
+            for term in terms[1:]
+        ]
+        hits: list[SearchHit] = []
+        high = len(self.keys)
+        window = SEARCH_WINDOW
+        while high > 0 and len(hits) < limit:
+            low = max(0, high - window)
+            docs = _members(terms[0], low, high)
+            for term, use_window in zip(terms[1:], windowed):
+                if not docs:
+                    break
+                if use_window:
+                    docs &= _members(term, low, high)
+                else:
+                    docs = {doc for doc in docs if _contains(term, doc)}
+            for doc in sorted(docs, reverse=True):
+                contact_of = self.doc_contacts[doc]
+                if contact_id is not None and contact_of != contact_id:
+                    if contact_id not in self.broadcast_contacts.get(doc, ()):
+                        continue
+                    contact_of = contact_id
+                hits.append(
+                    SearchHit(self.contacts[contact_of], self.keys[doc])
+                )
+                if len(hits) >= limit:
+                    break
+            high = low
+            window *= 2
+        return hits
+
+    def save(self, path: str | None = None) -> None:
+        """Writes a snapshot to path, by default where it was loaded."""
+        if path is None:
+            if self.path is None:
+                raise ValueError("no path to save the search index to")
+            path = self.path
+        header = {
+            "version": SNAPSHOT_VERSION,
+            "byteorder": sys.byteorder,
+            "itemsize": self.doc_contacts.itemsize,
+            "last_seq": self.last_seq,
+            "documents": len(self.keys),
+            "contacts": self.contacts,
+            # by document; all other keys are packed, in document order
+            "text_keys": {
+                doc: key
+                for doc, key in enumerate(self.keys)
+                if isinstance(key, str)
+            },
+            "broadcast_contacts": self.broadcast_contacts,
+            "tokens": self.tokens,
+            "postings": [len(self.postings[token]) for token in self.tokens],
+        }
+        with open(path + ".tmp", "wb") as f:
+            f.write(json.dumps(header).encode())
+            f.write(b"\n")
+            f.write(
+                b"".join(key for key in self.keys if isinstance(key, bytes))
+            )
+            self.doc_contacts.tofile(f)
+            for token in self.tokens:
+                self.postings[token].tofile(f)
+        os.replace(path + ".tmp", path)
+        self.saved_length = len(self.keys)
+
+    @classmethod
+    def load(cls, path: str) -> SearchIndex:
+        """Loads a snapshot written by save(), or returns an empty index
+        if there is none that can be used. Either way, save() writes to
+        path."""
+        index = cls()
+        index.path = path
+        try:
+            with open(path, "rb") as f:
+                header = json.loads(f.readline())
+                data = memoryview(f.read())
+            if (
+                header["version"] != SNAPSHOT_VERSION
+                or header["byteorder"] != sys.byteorder
+                or header["itemsize"] != index.doc_contacts.itemsize
+            ):
+                return index
+            documents = header["documents"]
+            text_keys = {
+                int(doc): key for doc, key in header["text_keys"].items()
+            }
+            keys: list[bytes | str] = []
+            offset = 0
+            for doc in range(documents):
+                if (key := text_keys.get(doc)) is None:
+                    key = bytes(data[offset : offset + PACKED_KEY_BYTES])
+                    offset += PACKED_KEY_BYTES
+                keys.append(key)
+
+            def read_array(length: int) -> array:
+                nonlocal offset
+                values = array("I")
+                end = offset + length * values.itemsize
+                values.frombytes(data[offset:end])
+                offset = end
+                return values
+
+            doc_contacts = read_array(documents)
+            postings = {
+                token: read_array(length)
+                for token, length in zip(header["tokens"], header["postings"])
+            }
+            if offset != len(data) or len(doc_contacts) != documents:
+                raise ValueError("the snapshot has the wrong length")
+        except Exception:
+            # missing, truncated or corrupt; the store is indexed again
+            return index
+        index.last_seq = header["last_seq"]
+        index.contacts = header["contacts"]
+        index.keys = keys
+        index.doc_contacts = doc_contacts
+        index.broadcast_contacts = {
+            int(doc): others
+            for doc, others in header["broadcast_contacts"].items()
+        }
+        index.postings = postings
+        index.contact_ids = {
+            contact: i for i, contact in enumerate(index.contacts)
+        }
+        index.tokens = sorted(index.postings)
+        index.saved_length = len(index.keys)
+        return index
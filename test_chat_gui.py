@@ -1,3 +1,4 @@
+from collections.abc import Sequence
 from typing import Any
 
 from chat_gui import ChatGui
@@ -11,8 +12,8 @@ def on_type(sender: str, receiver: str) -> None:
     print(f"Typing: {sender} --> {receiver}")
 
 
-def on_read(sender: str, receiver: str, uuid: str) -> None:
-    print(f"Read: {sender} --> {receiver} {uuid[:5]}...")
+def on_read(sender: str, receiver: str, uuids: Sequence[str]) -> None:
+    print(f"Read: {sender} --> {receiver} {len(uuids)} message(s)")
 
 
 def main() -> None:
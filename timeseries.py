@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import math
+import threading
+from array import array
+from bisect import bisect_left
+from typing import NamedTuple
+
+
+MINUTE = 60.0
+HOUR = 3600.0
+
+# Default retention: raw samples per sensor, then one day of minute and
+# thirty days of hour rollups. Memory per sensor grows with its readings
+# up to 16 bytes per raw sample and 40 bytes per rollup bucket.
+RAW_SAMPLES = 100_000
+MINUTE_BUCKETS = 24 * 60
+HOUR_BUCKETS = 30 * 24
+MAX_SERIES = 1_000
+
+RESOLUTION_RAW = "raw"
+RESOLUTION_MINUTE = "1m"
+RESOLUTION_HOUR = "1h"
+
+
+class Retention(NamedTuple):
+    raw_samples: int = RAW_SAMPLES
+    minute_buckets: int = MINUTE_BUCKETS
+    hour_buckets: int = HOUR_BUCKETS
+
+
+class Summary(NamedTuple):
+    count: int
+    min: float | None
+    max: float | None
+    mean: float | None
+
+
+class Ring:
+    """Fixed number of array('d') columns used as one ring buffer.
+
+    The columns grow as rows are appended until the capacity is reached,
+    then each row overwrites the oldest one. The first column must be
+    ascending, so a range of it is found by bisecting the two contiguous
+    halves of the ring.
+    """
+
+    def __init__(self, capacity: int, columns: int) -> None:
+        self.capacity = capacity
+        self.columns = [array("d") for _ in range(columns)]
+        self.start = 0  # index of the oldest row
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _index(self, row: int) -> int:
+        return (self.start + row) % self.capacity
+
+    def append(self, *values: float) -> None:
+        if self.count < self.capacity:
+            # start stays 0 until the ring is full
+            for column, value in zip(self.columns, values):
+                column.append(value)
+            self.count += 1
+            return
+        index = self.start
+        self.start = (self.start + 1) % self.capacity
+        for column, value in zip(self.columns, values):
+            column[index] = value
+
+    def last(self, column: int) -> float:
+        return self.columns[column][self._index(self.count - 1)]
+
+    def set_last(self, column: int, value: float) -> None:
+        self.columns[column][self._index(self.count - 1)] = value
+
+    def _halves(self) -> list[tuple[int, int]]:
+        end = self.start + self.count
+        if end <= self.capacity:
+            return [(self.start, end)]
+        return [(self.start, self.capacity), (0, end - self.capacity)]
+
+    def range(self, low: float, high: float) -> list[array]:
+        """Copies of the columns for the rows whose first column is in
+        [low, high)."""
+        keys = self.columns[0]
+        parts: list[tuple[int, int]] = []
+        for start, stop in self._halves():
+            first = bisect_left(keys, low, start, stop)
+            last = bisect_left(keys, high, first, stop)
+            if first < last:
+                parts.append((first, last))
+        result = []
+        for column in self.columns:
+            copy = array("d")
+            for first, last in parts:
+                copy += column[first:last]
+            result.append(copy)
+        return result
+
+
+class Rollup:
+    """Min, max, sum and count of the samples in buckets of width seconds,
+    updated as samples are added."""
+
+    def __init__(self, width: float, capacity: int) -> None:
+        self.width = width
+        # bucket start, min, max, sum, count
+        self.ring = Ring(capacity, 5)
+
+    def add(self, timestamp: float, value: float) -> None:
+        bucket = math.floor(timestamp / self.width) * self.width
+        ring = self.ring
+        if ring.count and ring.last(0) == bucket:
+            ring.set_last(1, min(ring.last(1), value))
+            ring.set_last(2, max(ring.last(2), value))
+            ring.set_last(3, ring.last(3) + value)
+            ring.set_last(4, ring.last(4) + 1)
+        else:
+            ring.append(bucket, value, value, value, 1)
+
+
+class Series:
+    """Raw samples of one sensor and their minute and hour rollups.
+
+    Samples must arrive in time order; a sample older than the newest one
+    is dropped and counted in late.
+    """
+
+    def __init__(self, retention: Retention) -> None:
+        self.raw = Ring(retention.raw_samples, 2)
+        self.rollups = {
+            RESOLUTION_MINUTE: Rollup(MINUTE, retention.minute_buckets),
+            RESOLUTION_HOUR: Rollup(HOUR, retention.hour_buckets),
+        }
+        self.late = 0
+        self.lock = threading.Lock()
+
+    def add(self, timestamp: float, value: float) -> bool:
+        if not (math.isfinite(timestamp) and math.isfinite(value)):
+            raise ValueError("time and value must be finite")
+        with self.lock:
+            if self.raw.count and timestamp < self.raw.last(0):
+                self.late += 1
+                return False
+            self.raw.append(timestamp, value)
+            for rollup in self.rollups.values():
+                rollup.add(timestamp, value)
+            return True
+
+    def query(
+        self, low: float, high: float, resolution: str = RESOLUTION_RAW
+    ) -> dict[str, list[float]]:
+        """The samples, or the rollup buckets, in [low, high) as lists of
+        times and values, or of times, min, max, mean and count."""
+        with self.lock:
+            if resolution == RESOLUTION_RAW:
+                times, values = self.raw.range(low, high)
+                return {"times": times.tolist(), "values": values.tolist()}
+            times, mins, maxs, sums, counts = self.rollups[
+                resolution
+            ].ring.range(low, high)
+        return {
+            "times": times.tolist(),
+            "min": mins.tolist(),
+            "max": maxs.tolist(),
+            "mean": list(map(float.__truediv__, sums, counts)),
+            "count": [int(count) for count in counts],
+        }
+
+    def summary(
+        self, low: float, high: float, resolution: str = RESOLUTION_RAW
+    ) -> Summary:
+        """Aggregates over [low, high), from the raw samples or, cheaper
+        for long ranges, from the rollup buckets that start in it."""
+        with self.lock:
+            if resolution == RESOLUTION_RAW:
+                _, values = self.raw.range(low, high)
+                mins = maxs = values
+                total, count = math.fsum(values), len(values)
+            else:
+                _, mins, maxs, sums, counts = self.rollups[
+                    resolution
+                ].ring.range(low, high)
+                total, count = math.fsum(sums), int(sum(counts))
+        if not count:
+            return Summary(0, None, None, None)
+        return Summary(count, min(mins), max(maxs), total / count)
+
+
+class TimeSeriesStore:
+    """Thread-safe in-memory time series of sensor readings by name.
+
+    Memory is bounded by the retention of each series and by max_series;
+    readings of further sensors are rejected.
+    """
+
+    def __init__(
+        self,
+        retention: Retention = Retention(),
+        max_series: int = MAX_SERIES,
+    ) -> None:
+        self.retention = retention
+        self.max_series = max_series
+        self.series: dict[str, Series] = {}
+        self.lock = threading.Lock()
+
+    def get(self, name: str) -> Series | None:
+        return self.series.get(name)
+
+    def names(self) -> list[str]:
+        return sorted(self.series)
+
+    def add(self, name: str, timestamp: float, value: float) -> bool:
+        if (series := self.series.get(name)) is None:
+            with self.lock:
+                if (series := self.series.get(name)) is None:
+                    if len(self.series) >= self.max_series:
+                        return False
+                    series = self.series[name] = Series(self.retention)
+        return series.add(timestamp, value)
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import logging
+from collections.abc import Callable, Collection
+from typing import Any
+
+from wire_codec import decode_payload, is_compact
+
+
+TOPIC_PREFIX = "ttm4175/chat/"
+
+LOGGER = logging.getLogger(__name__)
+
+Handler = Callable[[dict[str, Any]], None]
+
+
+def has_fields(data: Any, fields: Collection[str]) -> bool:
+    """True when data is an object with a string in each of fields, and a
+    list of strings in "uuids" if it has that field."""
+    if not isinstance(data, dict):
+        return False
+    if not all(isinstance(data.get(field), str) for field in fields):
+        return False
+    uuids = data.get("uuids")
+    return uuids is None or (
+        isinstance(uuids, list)
+        and all(isinstance(message_uuid, str) for message_uuid in uuids)
+    )
+
+
+class TopicRouter:
+    """Dispatches ttm4175/chat/{id}/{kind} messages to one handler per kind.
+
+    The topic is split once and looked up in a dict of handlers; messages
+    for unknown kinds or topics are counted and dropped before their
+    payload is decoded. Payloads that do not decode, or lack the fields
+    their kind was registered with, are counted as invalid and dropped
+    before their handler sees them. The router also remembers which
+    senders use the compact wire format, see wire_codec.
+    """
+
+    def __init__(self, prefix: str = TOPIC_PREFIX) -> None:
+        self.prefix = prefix
+        self.handlers: dict[str, Handler] = {}
+        # kind -> the string fields its handler needs
+        self.fields: dict[str, tuple[str, ...]] = {}
+        self.compact_peers: set[str] = set()
+        self.routed = 0
+        self.dropped = 0
+        self.invalid = 0
+
+    def register(
+        self, kind: str, handler: Handler, fields: Collection[str] = ()
+    ) -> None:
+        """Routes kind to handler. Every payload needs a sender; fields are
+        the other strings the handler reads."""
+        self.handlers[kind] = handler
+        self.fields[kind] = ("sender", *fields)
+
+    def route(self, topic: str, payload: bytes) -> bool:
+        chat_id, _, kind = topic[len(self.prefix) :].partition("/")
+        handler = self.handlers.get(kind)
+        if handler is None or not topic.startswith(self.prefix) or not chat_id:
+            self.dropped += 1
+            if LOGGER.isEnabledFor(logging.DEBUG):
+                LOGGER.debug("Dropping message on unknown topic %s", topic)
+            return False
+        try:
+            data = decode_payload(payload)
+        except ValueError as e:
+            self.invalid += 1
+            LOGGER.warning("Invalid payload on %s: %s", topic, e)
+            return False
+        if not has_fields(data, self.fields[kind]):
+            self.invalid += 1
+            LOGGER.warning(
+                "Invalid payload on %s: needs %s",
+                topic,
+                ", ".join(self.fields[kind]),
+            )
+            return False
+        if is_compact(payload):
+            self.compact_peers.add(data["sender"])
+        handler(data)
+        self.routed += 1
+        return True
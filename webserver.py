@@ -1,7 +1,52 @@
+import argparse
 import json
+import math
 import socket
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from urllib.parse import quote, unquote
+from typing import Any, BinaryIO
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+from json_stream import JsonReader
+from timeseries import (
+    RESOLUTION_HOUR,
+    RESOLUTION_MINUTE,
+    RESOLUTION_RAW,
+    TimeSeriesStore,
+)
+
+PORT = 8000
+WORKERS = 32
+# Idle keep-alive connections are closed after this, freeing their worker
+KEEP_ALIVE_SECONDS = 5.0
+# Connections that may wait for a worker; further ones get a 503
+MAX_PENDING_CONNECTIONS = 128
+BUSY_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Retry-After: 1\r\n"
+    b"Content-Length: 0\r\n"
+    b"Connection: close\r\n\r\n"
+)
+
+DATA_LOCK = threading.Lock()
+
+# Sensors POST batches of readings here, see RequestHandler.post_readings
+READINGS_PATH = "/readings"
+MAX_BODY_BYTES = 64 * 1024 * 1024
+READ_CHUNK_BYTES = 64 * 1024
+# Invalid readings described in the ack of a batch
+REPORTED_ERRORS = 10
+# Accepted times of readings, relative to the clock of the server
+MAX_READING_AGE_SECONDS = 365 * 24 * 3600.0
+MAX_CLOCK_SKEW_SECONDS = 3600.0
+# GET /series lists the sensors, GET /series/{name} queries one of them
+SERIES_PATH = "/series"
+RESOLUTIONS = (RESOLUTION_RAW, RESOLUTION_MINUTE, RESOLUTION_HOUR)
+# Queried range when the query has no from parameter
+DEFAULT_QUERY_SECONDS = 3600.0
 
 
 def extract_json_string(string: str) -> str:
@@ -34,69 +79,374 @@ def string_to_unicode_bytes(string: str) -> bytes:
     return string.encode("utf-8")
 
 
+def read_chunks(stream: BinaryIO, length: int) -> Iterator[bytes]:
+    """The next length bytes of stream, in chunks of READ_CHUNK_BYTES."""
+    remaining = length
+    while remaining:
+        chunk = stream.read(min(READ_CHUNK_BYTES, remaining))
+        if not chunk:
+            raise ValueError("body shorter than Content-Length")
+        remaining -= len(chunk)
+        yield chunk
+
+
+def iter_json_values(stream: BinaryIO, length: int) -> Iterator[Any]:
+    """Parses the next length bytes of stream as a JSON array or as NDJSON
+    (one JSON value per line) and yields the values one at a time.
+
+    The stream is read in chunks and only the unparsed rest of a chunk is
+    kept, so the whole body is never in memory at once. Raises ValueError
+    when it is not valid or a value is too long, see JsonReader.
+    """
+    reader = JsonReader(read_chunks(stream, length))
+    char = reader.next_char()
+    if char != "[":
+        while char is not None:
+            yield reader.value()
+            char = reader.next_char()
+        return
+    reader.pos += 1
+    if reader.next_char() == "]":
+        reader.pos += 1
+    else:
+        while True:
+            reader.next_char()
+            yield reader.value()
+            char = reader.next_char()
+            reader.pos += 1
+            if char == "]":
+                break
+            if char != ",":
+                raise ValueError("expected ',' or ']' in array")
+    if reader.next_char() is not None:
+        raise ValueError("data after the end of the array")
+
+
+def is_number(value: Any) -> bool:
+    """True for ints and floats that fit a finite float; json.loads also
+    accepts NaN, Infinity and integers of any size."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return False
+    try:
+        return math.isfinite(value)
+    except OverflowError:
+        return False
+
+
+def check_reading(reading: Any, now: float) -> str | None:
+    """Returns what is wrong with a reading, or None if it is valid."""
+    if not isinstance(reading, dict):
+        return "not an object"
+    if not is_number(reading.get("temperature")):
+        return "temperature is not a finite number"
+    if not isinstance(reading.get("sensor_name"), str):
+        return "sensor_name is not a string"
+    if "time" in reading:
+        timestamp = reading["time"]
+        if not is_number(timestamp):
+            return "time is not a finite number"
+        if (
+            not now - MAX_READING_AGE_SECONDS
+            <= timestamp
+            <= now + MAX_CLOCK_SKEW_SECONDS
+        ):
+            return "time is too far from now"
+    return None
+
+
 class RequestHandler(BaseHTTPRequestHandler):
+    # keep connections open between requests, every response has a
+    # Content-Length
+    protocol_version = "HTTP/1.1"
+    timeout = KEEP_ALIVE_SECONDS
+    # headers and body are written separately, which Nagle's algorithm
+    # would delay on a kept-alive connection
+    disable_nagle_algorithm = True
+
     def store_data(self, name: str, data: str) -> None:
-        setattr(
-            self.server,
-            "data",
-            getattr(self.server, "data", {}) | {name: data},
-        )
+        with DATA_LOCK:
+            if not hasattr(self.server, "data"):
+                setattr(self.server, "data", {})
+            getattr(self.server, "data")[name] = data
 
     def load_data(self, name: str) -> str | None:
         return getattr(self.server, "data", {}).get(name, None)
 
+    def verbose(self) -> bool:
+        return getattr(self.server, "verbose", True)
+
+    def log(self, text: Any) -> None:
+        if self.verbose():
+            print(text)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.verbose():
+            super().log_message(format, *args)
+
+    def read_body(self) -> bytes:
+        """Reads the request body, which must be done before the next
+        request on a keep-alive connection."""
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length > 0 else b""
+
+    def store_readings(self, readings: list[dict]) -> int:
+        """Adds the readings to the time series of the server, stamped with
+        their time or else now. Returns how many were dropped because they
+        were late or the store holds too many sensors."""
+        series: TimeSeriesStore = getattr(self.server, "series")
+        now = time.time()
+        dropped = 0
+        for reading in readings:
+            if not series.add(
+                reading["sensor_name"],
+                reading.get("time", now),
+                reading["temperature"],
+            ):
+                dropped += 1
+        return dropped
+
+    def send_text(
+        self, text: str, status: int = 200, content_type: str = "text/plain"
+    ) -> None:
+        response_in_bytes = string_to_unicode_bytes(text)
+        self.send_response(status)
+        self.send_header("Content-type", content_type)
+        self.send_header("Content-Length", str(len(response_in_bytes)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(response_in_bytes)
+
+    def send_json(self, data: Any, status: int = 200) -> None:
+        self.send_text(json.dumps(data), status, "application/json")
+
+    def post_readings(self) -> None:
+        """Ingests a batch of readings from the request body, either a JSON
+        array or NDJSON, each like {"temperature": 20.5, "sensor_name":
+        "kitchen"}.
+
+        The batch is acknowledged as a whole with the number of accepted
+        readings, and valid ones that the time series did not take are
+        counted as dropped. If any reading is invalid, or the body is not
+        valid JSON, nothing is stored and the response is 400; invalid
+        readings are counted as rejected and described in errors.
+        """
+        try:
+            length = int(self.headers["Content-Length"])
+        except (TypeError, ValueError):
+            self.close_connection = True
+            self.send_json({"error": "Content-Length required"}, 411)
+            return
+        if length < 0:
+            # rfile.read(-1) would wait for the client to close
+            self.close_connection = True
+            self.send_json({"error": "negative Content-Length"}, 400)
+            return
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            self.send_json({"error": "body too large"}, 413)
+            return
+        readings: list[dict] = []
+        errors: list[dict[str, Any]] = []
+        rejected = 0
+        now = time.time()
+        try:
+            for index, reading in enumerate(
+                iter_json_values(self.rfile, length)
+            ):
+                if (error := check_reading(reading, now)) is None:
+                    readings.append(reading)
+                    continue
+                rejected += 1
+                if len(errors) < REPORTED_ERRORS:
+                    errors.append({"index": index, "error": error})
+        except ValueError as e:
+            # the rest of the body is not read
+            self.close_connection = True
+            self.send_json({"error": str(e)}, 400)
+            return
+        if rejected:
+            self.log(f"batch of {len(readings) + rejected} readings rejected")
+            self.send_json(
+                {
+                    "accepted": 0,
+                    "rejected": rejected,
+                    "dropped": 0,
+                    "errors": errors,
+                },
+                400,
+            )
+            return
+        dropped = self.store_readings(readings)
+        self.log(f"{len(readings)} readings received")
+        self.send_json(
+            {
+                "accepted": len(readings) - dropped,
+                "rejected": 0,
+                "dropped": dropped,
+                "errors": errors,
+            }
+        )
+
+    def get_series(self, path: str, query: str) -> None:
+        """GET /series lists the sensors. GET /series/{name}?from=&to=
+        &resolution= returns the readings of one sensor in [from, to), in
+        seconds since the epoch, as raw samples or as 1m or 1h rollups
+        with min, max and mean, and a summary of the range. points=0
+        leaves out the samples."""
+        series: TimeSeriesStore = getattr(self.server, "series")
+        name = unquote(path[len(SERIES_PATH) + 1 :])
+        if not name:
+            self.send_json({"sensors": series.names()})
+            return
+        if (sensor := series.get(name)) is None:
+            self.send_json({"error": f"unknown sensor {name}"}, 404)
+            return
+        parameters = {
+            key: values[-1] for key, values in parse_qs(query).items()
+        }
+        resolution = parameters.get("resolution", RESOLUTION_RAW)
+        try:
+            high = float(parameters.get("to", math.inf))
+            low = float(
+                parameters.get("from", time.time() - DEFAULT_QUERY_SECONDS)
+            )
+            if math.isnan(low) or math.isnan(high):
+                raise ValueError
+        except ValueError:
+            self.send_json({"error": "from and to must be numbers"}, 400)
+            return
+        if resolution not in RESOLUTIONS:
+            self.send_json(
+                {"error": f"resolution must be one of {RESOLUTIONS}"}, 400
+            )
+            return
+        response: dict[str, Any] = {"sensor": name, "resolution": resolution}
+        response["summary"] = sensor.summary(low, high, resolution)._asdict()
+        if parameters.get("points") != "0":
+            response.update(sensor.query(low, high, resolution))
+        self.send_json(response)
+
     def do_GET(self) -> None:
         # Phase 1: What has been requested?
-        print("-------- Incoming GET request --------")
-        print(f"  Request data: {self.requestline}")
+        self.log("-------- Incoming GET request --------")
+        self.log(f"  Request data: {self.requestline}")
+        url = urlsplit(self.path)
+        if url.path == SERIES_PATH or url.path.startswith(SERIES_PATH + "/"):
+            self.get_series(url.path, url.query)
+            return
 
         # Phase 2: Which data do we want to send back?
         response = "Hei hei"
 
         # Phase 3: Let's send back the data!
-        response_in_bytes = string_to_unicode_bytes(response)
-        self.send_response(200)
-        self.send_header("Content-type", "text/plain")
-        self.end_headers()
-        self.wfile.write(response_in_bytes)
+        self.send_text(response)
 
     def do_POST(self):
         """HTTP POST request as it comes from the sensor device application,
-        for instance to send the current temerature."""
+        for instance to send the current temerature. Batches of readings
+        go to READINGS_PATH instead."""
 
-        print("-------- Incoming POST request --------")
-        print(f"  Request data: {self.requestline}")
+        if self.path.partition("?")[0] == READINGS_PATH:
+            self.post_readings()
+            return
+
+        self.log("-------- Incoming POST request --------")
+        self.log(f"  Request data: {self.requestline}")
+        self.read_body()
 
         decoded_request = decode_url_back_to_string(self.requestline)
-        print(f"  Decoded data: {decoded_request}")
+        self.log(f"  Decoded data: {decoded_request}")
 
         json_string = extract_json_string(decoded_request)
-        print(f"  Extracted JSON string: {json_string}")
+        self.log(f"  Extracted JSON string: {json_string}")
 
         dictionary = json_string_to_dictionary(json_string)
-        print(dictionary)
+        self.log(dictionary)
 
         # We extract the temperature...
         temperature = dictionary["temperature"]
-        print(f"Temperature {temperature} received in do_POST()")
+        self.log(f"Temperature {temperature} received in do_POST()")
         # ...and store it
         # self.store_data("temperature", temperature)
 
         response = "ok"
 
-        response_in_bytes = string_to_unicode_bytes(response)
-        self.send_response(200)
-        self.send_header("Content-type", "text/plain")
-        self.end_headers()
-        self.wfile.write(response_in_bytes)
+        self.send_text(response)
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer that handles connections on a bounded pool of threads.
+
+    A keep-alive connection holds its worker until the client closes it or
+    it is idle for KEEP_ALIVE_SECONDS; further connections wait for a free
+    worker. At most max_pending connections wait, beyond that a connection
+    is answered with 503 and closed, so a flood of connections cannot grow
+    the pool's queue without bound. Set verbose to False to switch off the
+    per-request output.
+    """
+
+    # the default of 5 drops connections in bursts
+    request_queue_size = 128
+
+    def __init__(
+        self,
+        server_address: tuple[str, int],
+        handler: type[BaseHTTPRequestHandler],
+        workers: int = WORKERS,
+        max_pending: int = MAX_PENDING_CONNECTIONS,
+    ) -> None:
+        super().__init__(server_address, handler)
+        self.verbose = True
+        self.series = TimeSeriesStore()
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="http")
+        # connections being handled or waiting for a worker
+        self.slots = threading.BoundedSemaphore(workers + max_pending)
+        self.refused = 0
+
+    def process_request(self, request: Any, client_address: Any) -> None:
+        if not self.slots.acquire(blocking=False):
+            self.refused += 1
+            self.refuse_request(request)
+            return
+        try:
+            self.pool.submit(self._process_request, request, client_address)
+        except RuntimeError:  # the pool is shut down
+            self.slots.release()
+            self.shutdown_request(request)
+
+    def refuse_request(self, request: Any) -> None:
+        try:
+            request.sendall(BUSY_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def _process_request(self, request: Any, client_address: Any) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
 
 
 def main() -> None:
-    port = 8000
-    httpd = HTTPServer(
-        ("", port),
-        RequestHandler,
+    parser = argparse.ArgumentParser(description="TTM4175 web server")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument(
+        "--quiet", action="store_true", help="no output per request"
     )
+    args = parser.parse_args()
+    port = args.port
+    httpd = PooledHTTPServer(("", port), RequestHandler, args.workers)
+    httpd.verbose = not args.quiet
     print(
         "\n******** TTM4175 Web Server  ********\n"
         f"    The server will be reachable via  http://{get_ip_address()}:{port}/\n"
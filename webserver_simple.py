@@ -4,7 +4,7 @@ from urllib.parse import quote, unquote
 
 import requests
 
-from webserver import RequestHandler
+from webserver import READINGS_PATH, RequestHandler
 
 
 def extract_json_string(string: str) -> str:
@@ -50,37 +50,42 @@ def do_POST(self: RequestHandler) -> None:
     instance to send the current temerature.
     """
 
-    print("-------- Incoming POST request --------")
-    print(f"  Request data: {self.requestline}")
+    self.log("-------- Incoming POST request --------")
+    self.log(f"  Request data: {self.requestline}")
+    self.read_body()
 
     decoded_request = decode_url_back_to_string(self.requestline)
-    print(f"  Decoded data: {decoded_request}")
+    self.log(f"  Decoded data: {decoded_request}")
 
     json_string = extract_json_string(decoded_request)
-    print(f"  Extracted JSON string: {json_string}")
+    self.log(f"  Extracted JSON string: {json_string}")
 
     dictionary = json_string_to_dictionary(json_string)
-    print(dictionary)
+    self.log(dictionary)
 
     temperature = dictionary["temperature"]
-    print(f"Temperature {temperature} received in do_POST()")
+    self.log(f"Temperature {temperature} received in do_POST()")
     self.store_data("temperature", temperature)
 
     response = "ok"
 
-    response_in_bytes = string_to_unicode_bytes(response)
-    self.send_response(200)
-    self.send_header("Content-type", "text/plain")
-    self.end_headers()
-    self.wfile.write(response_in_bytes)
+    self.send_text(response)
 
 
 def main() -> None:
-    dictionary = {"temperature": 20.0, "sensor_name": "kitchen"}
+    # one request for many readings; one JSON object per line (NDJSON)
+    # works as well
+    readings = [
+        {"temperature": 20.0, "sensor_name": "kitchen"},
+        {"temperature": 20.5, "sensor_name": "kitchen"},
+        {"temperature": 18.0, "sensor_name": "bedroom"},
+    ]
 
     port = 8000
     response = requests.post(
-        f"http://{get_ip_address()}:{port}/?data={dictionary}", timeout=10
+        f"http://{get_ip_address()}:{port}{READINGS_PATH}",
+        json=readings,
+        timeout=10,
     )
     print_response(response)
 
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import json
+import struct
+from typing import Any
+
+
+# Compact payloads start with a byte that can never start a JSON document
+# (nor any UTF-8 text), followed by the format version.
+MAGIC = 0xC1
+VERSION = 1
+
+FLAG_PACKED_UUIDS = 0x01
+FLAG_UUIDS = 0x02
+FLAG_MESSAGE = 0x04
+
+COMPACT_KEYS = frozenset(("sender", "receiver", "message", "uuid", "uuids"))
+
+_HEADER = struct.Struct("!BBB")
+_COUNT = struct.Struct("!H")
+
+
+def is_compact(payload: bytes) -> bool:
+    return bool(payload) and payload[0] == MAGIC
+
+
+def _packed(uuids: list[str]) -> bytes | None:
+    """Packs lowercase hex uuids into 16 bytes each, if they all are."""
+    if not all(len(message_uuid) == 32 for message_uuid in uuids):
+        return None
+    joined = "".join(uuids)
+    try:
+        packed = bytes.fromhex(joined)
+    except ValueError:
+        return None
+    if packed.hex() != joined:
+        return None
+    return packed
+
+
+def _short_string(string: str) -> bytes:
+    data = string.encode()
+    if len(data) > 255:
+        raise ValueError(f"{string[:20]}... is too long for a compact field")
+    return bytes((len(data),)) + data
+
+
+def encode_compact(payload_dict: dict[str, Any]) -> bytes | None:
+    """Encodes a chat payload in the compact format, or returns None when
+    it has fields the format cannot carry."""
+    if not payload_dict.keys() <= COMPACT_KEYS:
+        return None
+    uuids: list[str] = payload_dict.get("uuids") or (
+        [payload_dict["uuid"]] if "uuid" in payload_dict else []
+    )
+    flags = 0
+    parts = [b"", _short_string(payload_dict["sender"])]
+    parts.append(_short_string(payload_dict["receiver"]))
+    if uuids:
+        flags |= FLAG_UUIDS
+        parts.append(_COUNT.pack(len(uuids)))
+        if (packed := _packed(uuids)) is not None:
+            flags |= FLAG_PACKED_UUIDS
+            parts.append(packed)
+        else:
+            parts.extend(_short_string(message_uuid) for message_uuid in uuids)
+    if "message" in payload_dict:
+        flags |= FLAG_MESSAGE
+        parts.append(payload_dict["message"].encode())
+    parts[0] = _HEADER.pack(MAGIC, VERSION, flags)
+    return b"".join(parts)
+
+
+def _read_short_string(payload: bytes, offset: int) -> tuple[str, int]:
+    end = offset + 1 + payload[offset]
+    return payload[offset + 1 : end].decode(), end
+
+
+def decode_compact(payload: bytes) -> dict[str, Any]:
+    try:
+        magic, version, flags = _HEADER.unpack_from(payload)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Unsupported compact payload version {version}")
+        sender, offset = _read_short_string(payload, _HEADER.size)
+        receiver, offset = _read_short_string(payload, offset)
+        data: dict[str, Any] = {"sender": sender, "receiver": receiver}
+        if flags & FLAG_UUIDS:
+            (count,) = _COUNT.unpack_from(payload, offset)
+            offset += _COUNT.size
+            uuids: list[str] = []
+            if flags & FLAG_PACKED_UUIDS:
+                hexed = payload[offset : offset + 16 * count].hex()
+                if len(hexed) != 32 * count:
+                    raise ValueError("Truncated uuids")
+                uuids = [hexed[i : i + 32] for i in range(0, len(hexed), 32)]
+                offset += 16 * count
+            else:
+                for _ in range(count):
+                    message_uuid, offset = _read_short_string(payload, offset)
+                    uuids.append(message_uuid)
+            data["uuid"] = uuids[-1]
+            if count > 1:
+                data["uuids"] = uuids
+        if flags & FLAG_MESSAGE:
+            data["message"] = payload[offset:].decode()
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"Malformed compact payload: {e}") from e
+    return data
+
+
+def encode_payload(payload_dict: dict[str, Any], compact: bool) -> bytes:
+    if compact and (payload := encode_compact(payload_dict)) is not None:
+        return payload
+    return json.dumps(payload_dict).encode()
+
+
+def decode_payload(payload: bytes) -> dict[str, Any]:
+    """Decodes either format. Raises ValueError for invalid payloads."""
+    if is_compact(payload):
+        return decode_compact(payload)
+    return json.loads(payload)